@@ -0,0 +1,200 @@
+import bisect
+import hashlib
+from collections import Counter
+
+# 客户端在 caps 中声明 clip_delta 后，剪贴板同步可使用增量格式:
+#   全量: {"type": "CLIPBOARD_SYNC", "id": <内容id>, "content": "..."}
+#   增量: {"type": "CLIPBOARD_SYNC", "id": <内容id>, "base": <基准内容id>, "delta": [[start, end, "text"], ...]}
+#         基准为对方最近一次确认 (CLIPBOARD_ACK) 的内容，依次把 base[start:end] 替换为 text；
+#         start/end 是 UTF-16 码元下标 (与 Dart/Java/JS 的字符串下标一致，emoji 等 BMP 以外的字符占 2 个)
+#   确认: {"type": "CLIPBOARD_ACK", "id": <内容id>, "ok": true}
+#         ok=false 表示本地没有该基准内容，发送方清除基准，下一次改发全量
+DELTA_CAP = "clip_delta"
+MIN_DELTA_SIZE = 1024  # 小于该长度的内容直接全量发送
+MAX_DELTA_RATIO = 0.5  # 增量超过全量的一半就不划算
+_LINE_DIFF_LIMIT = 100000  # 按行细分差异的行数上限 (约 0.4 秒)，超过则只去掉公共前后缀
+_BLOCK = 4096
+
+
+def content_id(text):
+    return hashlib.sha1(text.encode("utf-8", "surrogatepass")).hexdigest()[:16]
+
+
+def _common_prefix(a, b):
+    n = min(len(a), len(b))
+    i = 0
+    # 先按块比较 (切片比较在 C 中完成)，再在不同的块内逐字符定位
+    while i + _BLOCK <= n and a[i:i + _BLOCK] == b[i:i + _BLOCK]:
+        i += _BLOCK
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def _common_suffix(a, b, limit):
+    """不超过 limit 个字符的公共后缀长度 (limit 保证后缀不与前缀重叠)"""
+    la, lb = len(a), len(b)
+    i = 0
+    while i + _BLOCK <= limit and a[la - i - _BLOCK:la - i] == b[lb - i - _BLOCK:lb - i]:
+        i += _BLOCK
+    while i < limit and a[la - i - 1] == b[lb - i - 1]:
+        i += 1
+    return i
+
+
+def make_delta(base, text):
+    """
+    计算把 base 变成 text 的替换操作 [[start, end, text], ...] (offset 为 base 中的 UTF-16 码元下标，升序不重叠)。
+    先去掉公共前后缀，中间部分再以两边都只出现一次的行为锚点按行细分 (线性复杂度，重复行很多的日志也不会变慢)。
+    不划算时返回 None，调用方改发全量。
+    """
+    if len(text) < MIN_DELTA_SIZE:
+        return None
+    prefix = _common_prefix(base, text)
+    suffix = _common_suffix(base, text, min(len(base), len(text)) - prefix)
+    a_mid = base[prefix:len(base) - suffix]
+    b_mid = text[prefix:len(text) - suffix]
+
+    ops = [[prefix, prefix + len(a_mid), b_mid]]
+    a_lines = a_mid.splitlines(keepends=True)
+    b_lines = b_mid.splitlines(keepends=True)
+    if 1 < len(a_lines) <= _LINE_DIFF_LIMIT and 1 < len(b_lines) <= _LINE_DIFF_LIMIT:
+        # 多处分散修改: 按行对齐，只发送变化的行
+        line_ops = _line_ops(a_lines, b_lines, prefix)
+        if line_ops and _delta_size(line_ops) < _delta_size(ops):
+            ops = line_ops
+
+    if _delta_size(ops) > len(text) * MAX_DELTA_RATIO:
+        return None
+    return _to_utf16(base, ops)
+
+
+def _line_ops(a_lines, b_lines, offset):
+    """
+    以两边都只出现一次的行为锚点 (patience diff)，取行号递增的最长锚点序列，
+    锚点之间的区段去掉首尾相同的行后生成替换操作
+    """
+    a_count = Counter(a_lines)
+    b_count = Counter(b_lines)
+    b_unique = {line: j for j, line in enumerate(b_lines) if b_count[line] == 1}
+    pairs = [(i, b_unique[line]) for i, line in enumerate(a_lines) if a_count[line] == 1 and line in b_unique]
+    anchors = _longest_increasing(pairs)
+
+    a_offsets = [offset]
+    for line in a_lines:
+        a_offsets.append(a_offsets[-1] + len(line))
+    ops = []
+    i = j = 0
+    for ai, bj in anchors + [(len(a_lines), len(b_lines))]:
+        i2, j2 = ai, bj
+        while i < i2 and j < j2 and a_lines[i] == b_lines[j]:
+            i += 1
+            j += 1
+        while i < i2 and j < j2 and a_lines[i2 - 1] == b_lines[j2 - 1]:
+            i2 -= 1
+            j2 -= 1
+        if i < i2 or j < j2:
+            ops.append([a_offsets[i], a_offsets[i2], "".join(b_lines[j:j2])])
+        i, j = ai + 1, bj + 1
+    return ops
+
+
+def _longest_increasing(pairs):
+    """pairs 按 a 行号升序，返回 b 行号严格递增的最长子序列 (O(n log n))"""
+    tails = []  # tails[k]: 长度为 k+1 的递增序列中最小的结尾 b 行号
+    tail_idx = []
+    prev = [-1] * len(pairs)
+    for n, (_, j) in enumerate(pairs):
+        k = bisect.bisect_left(tails, j)
+        if k == len(tails):
+            tails.append(j)
+            tail_idx.append(n)
+        else:
+            tails[k] = j
+            tail_idx[k] = n
+        prev[n] = tail_idx[k - 1] if k else -1
+    result = []
+    n = tail_idx[-1] if tail_idx else -1
+    while n >= 0:
+        result.append(pairs[n])
+        n = prev[n]
+    result.reverse()
+    return result
+
+
+def _utf16_len(text):
+    return len(text.encode("utf-16-le", "surrogatepass")) // 2
+
+
+def _to_utf16(base, ops):
+    """把字符 (code point) 下标换算为 UTF-16 码元下标；纯 ASCII 时两者相同"""
+    if base.isascii():
+        return ops
+    result = []
+    pos = units = 0
+    for start, end, text in ops:
+        units += _utf16_len(base[pos:start])
+        begin = units
+        units += _utf16_len(base[start:end])
+        pos = end
+        result.append([begin, units, text])
+    return result
+
+
+def _delta_size(ops):
+    return sum(len(t) + 16 for _, _, t in ops)
+
+
+def apply_delta(base, ops):
+    """按 UTF-16 码元下标应用替换操作"""
+    ascii_base = base.isascii()
+    data = base if ascii_base else base.encode("utf-16-le", "surrogatepass")
+    width = 1 if ascii_base else 2
+    length = len(data) // width
+    pieces = []
+    pos = 0
+    for start, end, text in ops:
+        if not isinstance(start, int) or not isinstance(end, int) or start < pos or end < start or end > length:
+            raise ValueError("无效的剪贴板增量")
+        pieces.append(data[pos * width:start * width])
+        pieces.append(text if ascii_base else text.encode("utf-16-le", "surrogatepass"))
+        pos = end
+    pieces.append(data[pos * width:])
+    if ascii_base:
+        return "".join(pieces)
+    # 下标落在代理对中间时会得到孤立代理项，随后的内容 id 校验不通过，按基准不符处理
+    return b"".join(pieces).decode("utf-16-le", "surrogatepass")
+
+
+def encode(text, base=None):
+    """
+    生成 CLIPBOARD_SYNC 的内容字段 (增量的 offset 为 UTF-16 码元下标)
+    :param base: (基准id, 基准内容)，为对方最近确认的内容；None 时发送全量
+    """
+    fields = {"id": content_id(text)}
+    ops = make_delta(base[1], text) if base else None
+    if ops is None:
+        fields["content"] = text
+    else:
+        fields["base"] = base[0]
+        fields["delta"] = ops
+    return fields
+
+
+def decode(data, base=None):
+    """
+    还原 CLIPBOARD_SYNC 中的内容
+    :param base: (基准id, 基准内容)，本端最近确认的对方内容
+    :return: 文本；增量的基准与本地不符时返回 None (应回复 ok=false 请求全量)
+    """
+    if "delta" not in data:
+        return data.get("content", "")
+    if not base or data.get("base") != base[0]:
+        return None
+    try:
+        text = apply_delta(base[1], data["delta"])
+    except (ValueError, TypeError):
+        return None
+    if data.get("id") and content_id(text) != data["id"]:
+        return None
+    return text
@@ -0,0 +1,205 @@
+import asyncio
+import ipaddress
+import json
+import logging
+import socket
+import struct
+import sys
+import time
+
+DISCOVERY_PORT = 8766
+MULTICAST_GROUP = "239.255.86.50"
+
+
+def get_local_addresses():
+    """
+    枚举本机可用的 IPv4 地址 (不启动子进程)，默认路由所在网卡排在最前。
+    排除回环与 169.254.x.x 自动分配地址。
+    """
+    found = []
+
+    # 1. 默认路由地址: UDP connect 只选路由，不实际发包
+    try:
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            s.connect(("10.255.255.255", 1))
+            found.append(s.getsockname()[0])
+        finally:
+            s.close()
+    except OSError:
+        pass
+
+    # 2. 主机名解析 (Windows 上会列出所有网卡地址)
+    try:
+        for info in socket.getaddrinfo(socket.gethostname(), None, socket.AF_INET):
+            found.append(info[4][0])
+    except OSError:
+        pass
+
+    # 3. Linux / macOS: 逐网卡读取地址
+    if hasattr(socket, "if_nameindex"):
+        try:
+            import fcntl
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                for _, name in socket.if_nameindex():
+                    try:
+                        req = struct.pack("256s", name.encode()[:15])
+                        res = fcntl.ioctl(s.fileno(), 0x8915, req)  # SIOCGIFADDR
+                        found.append(socket.inet_ntoa(res[20:24]))
+                    except OSError:
+                        pass
+            finally:
+                s.close()
+        except (ImportError, OSError):
+            pass
+
+    addresses = []
+    for addr in found:
+        try:
+            ip = ipaddress.IPv4Address(addr)
+        except ValueError:
+            continue
+        if ip.is_loopback or ip.is_link_local or ip.is_unspecified:
+            continue
+        if addr not in addresses:
+            addresses.append(addr)
+    return addresses
+
+
+class DiscoveryResponder(asyncio.DatagramProtocol):
+    """
+    局域网自动发现 (与 WebSocketServer 运行在同一事件循环):
+    监听 UDP 广播/组播探测包 {"type": "DISCOVER"}，
+    单播回复 {"type": "ANNOUNCE", "addresses": [...], "port": ..., "version": ...}
+    """
+    def __init__(self, service_port, version, host="0.0.0.0", port=DISCOVERY_PORT, name=None):
+        """
+        :param service_port: WebSocket 服务端口 (写入回复)
+        :param port: 发现服务监听的 UDP 端口，传 0 则由系统分配 (测试用)
+        """
+        self.service_port = service_port
+        self.version = version
+        self.host = host
+        self.port = port
+        self.name = name or socket.gethostname()
+        self.transport = None
+        self._addresses = []
+        self._addresses_time = 0
+        self._refreshing = False
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        sock.bind((self.host, self.port))
+        self.port = sock.getsockname()[1]
+        # 枚举网卡会做主机名解析 (Windows 上可能阻塞数秒)，放到线程池，不阻塞 WebSocket 收发
+        self._addresses = await loop.run_in_executor(None, get_local_addresses)
+        self._addresses_time = time.monotonic()
+        # 在每块网卡上加入组播组 (INADDR_ANY 只会加入默认网卡)
+        for addr in ["0.0.0.0"] + self._addresses:
+            try:
+                mreq = socket.inet_aton(MULTICAST_GROUP) + socket.inet_aton(addr)
+                sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+            except OSError:
+                pass
+        self.transport, _ = await loop.create_datagram_endpoint(lambda: self, sock=sock)
+        logging.info(f"局域网发现服务已启动: UDP {self.port}")
+
+    def stop(self):
+        if self.transport:
+            self.transport.close()
+            self.transport = None
+
+    def _get_addresses(self):
+        """
+        返回缓存的地址列表。网卡变化 (切换 Wi-Fi) 后需要刷新: 缓存超过 5 秒时在线程池中后台刷新，
+        本次探测仍用旧列表回复 (客户端优先使用回复来源地址，列表稍旧不影响连接)
+        """
+        if time.monotonic() - self._addresses_time > 5 and not self._refreshing:
+            self._refreshing = True
+            future = asyncio.get_running_loop().run_in_executor(None, get_local_addresses)
+            future.add_done_callback(self._on_addresses_refreshed)
+        return self._addresses
+
+    def _on_addresses_refreshed(self, future):
+        self._refreshing = False
+        self._addresses_time = time.monotonic()
+        try:
+            self._addresses = future.result()
+        except Exception as e:
+            logging.error(f"枚举网卡地址失败: {e}")
+
+    def datagram_received(self, data, addr):
+        if len(data) > 1024:
+            return
+        try:
+            probe = json.loads(data)
+        except ValueError:
+            return
+        if not isinstance(probe, dict) or probe.get("type") != "DISCOVER":
+            return
+        reply = {
+            "type": "ANNOUNCE",
+            "name": self.name,
+            "version": self.version,
+            "port": self.service_port,
+            "addresses": self._get_addresses(),
+        }
+        self.transport.sendto(json.dumps(reply).encode(), addr)
+
+
+def discover(timeout=1.0, port=DISCOVERY_PORT, targets=None, wait_all=False):
+    """
+    客户端探测 (供测试与调试使用，手机端实现相同协议)
+    :param targets: 额外的单播目标地址列表，例如 ["127.0.0.1"]
+    :param wait_all: False 时收到第一个回复即返回
+    :return: 回复列表，每项附带 "from" (回复来源 IP，客户端应优先使用该地址)
+    """
+    probe = json.dumps({"type": "DISCOVER"}).encode()
+    results = []
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        for target in (targets or []) + ["255.255.255.255", MULTICAST_GROUP]:
+            try:
+                sock.sendto(probe, (target, port))
+            except OSError:
+                pass
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            sock.settimeout(remaining)
+            try:
+                data, addr = sock.recvfrom(4096)
+            except (socket.timeout, OSError):
+                break
+            try:
+                reply = json.loads(data)
+            except ValueError:
+                continue
+            if reply.get("type") != "ANNOUNCE":
+                continue
+            reply["from"] = addr[0]
+            if any(r["from"] == addr[0] and r.get("port") == reply.get("port") for r in results):
+                continue  # 同时收到广播与组播的重复回复
+            results.append(reply)
+            if not wait_all:
+                break
+    finally:
+        sock.close()
+    return results
+
+
+if __name__ == "__main__":
+    t0 = time.perf_counter()
+    servers = discover(wait_all=True, targets=sys.argv[1:])
+    for s in servers:
+        print(f"{s['from']}: {s['name']} {s['version']} port={s['port']} addresses={s['addresses']}")
+    if not servers:
+        print("未发现服务端")
+    print(f"耗时 {(time.perf_counter() - t0) * 1000:.0f} ms")
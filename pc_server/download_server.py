@@ -0,0 +1,232 @@
+import asyncio
+import logging
+import os
+import re
+import secrets
+import time
+from urllib.parse import quote
+
+from transfer_queue import TransferCancelled
+
+HTTP_PORT = 8767
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+SEND_CHUNK = 256 * 1024  # 每次 sendfile 的字节数，块之间做进度统计与限速
+
+
+class _Published:
+    def __init__(self, path, size, expires, on_complete, control):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.size = size
+        self.expires = expires
+        self.on_complete = on_complete
+        self.control = control
+        self.served = []  # 已完整发送的区间 [start, end)，用于判断整个文件是否已下载
+        self.completed = False
+        self.active = 0  # 正在发送的请求数
+
+    def mark_served(self, start, end):
+        if end <= start or self.completed:
+            return
+        before = sum(e - s for s, e in self.served)
+        self.served.append((start, end))
+        self.served.sort()
+        merged = []
+        for s, e in self.served:
+            if merged and s <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], e))
+            else:
+                merged.append((s, e))
+        self.served = merged
+        if self.control:
+            # 只统计新覆盖的字节: 客户端重复下载同一区间不会让进度超过文件大小
+            self.control.on_progress(sum(e - s for s, e in merged) - before)
+        if merged[0][0] == 0 and merged[0][1] >= self.size:
+            self.completed = True
+            if self.on_complete:
+                try:
+                    self.on_complete()
+                except Exception as e:
+                    logging.error(f"下载完成回调失败: {e}")
+
+
+class DownloadServer:
+    """
+    PC→手机 文件下载旁路 (HTTP/1.1)。
+    FileManager 以短期 token 发布文件，客户端 GET /files/<token> 下载。
+    - 正文通过 loop.sendfile 发送 (Linux: os.sendfile，Windows: TransmitFile)，零拷贝
+    - 支持 Range，可断点续传或多连接分段并行下载
+    """
+    def __init__(self, host="0.0.0.0", port=HTTP_PORT, token_ttl=300):
+        """
+        :param port: 监听端口，传 0 则由系统分配 (测试用)
+        :param token_ttl: token 空闲有效期 (秒)，每次访问都会顺延；超过该时间无人访问才失效 (新请求返回 404)。
+                          正在下载或已下载一部分的文件不会失效，保证大文件可以断点续传/分段下载
+        """
+        self.host = host
+        self.port = port
+        self.token_ttl = token_ttl
+        self.files = {}
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logging.info(f"HTTP 下载通道已启动: {self.host}:{self.port}")
+
+    def stop(self):
+        if self._server:
+            self._server.close()
+            self._server = None
+
+    def publish(self, path, on_complete=None, control=None):
+        """
+        发布文件 (线程安全)
+        :param on_complete: 整个文件都被下载过一遍后回调 (事件循环线程)
+        :param control: 可选的传输控制 (transfer_queue.Transfer)。每块数据发送前调用 control.poll_chunk(n)
+                        做限速/暂停/取消，发送后以新下载的字节数调用 control.on_progress(n)
+        :return: 下载路径，例如 /files/<token>
+        """
+        token = secrets.token_urlsafe(16)
+        self.files[token] = _Published(path, os.path.getsize(path), time.monotonic() + self.token_ttl,
+                                       on_complete, control)
+        return f"/files/{token}"
+
+    def is_published(self, path):
+        """下载路径是否仍有效 (未撤销、未过期)"""
+        return path[len("/files/"):] in self.files
+
+    def unpublish(self, path):
+        """撤销下载路径，之后的新请求返回 404"""
+        self.files.pop(path[len("/files/"):], None)
+
+    def _lookup(self, target):
+        now = time.monotonic()
+        for token, entry in list(self.files.items()):
+            partial = entry.served and not entry.completed
+            if entry.expires < now and not entry.active and not partial:
+                del self.files[token]
+        if not target.startswith("/files/"):
+            return None
+        entry = self.files.get(target[len("/files/"):].split("?")[0])
+        if entry:
+            entry.expires = now + self.token_ttl
+        return entry
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), 30)
+                except asyncio.TimeoutError:
+                    break
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    if len(headers) > 64:
+                        return
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+
+                parts = request_line.decode("latin-1").split()
+                if len(parts) != 3:
+                    await self._respond(writer, 400, "Bad Request")
+                    break
+                method, target, version = parts
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+
+                if method not in ("GET", "HEAD"):
+                    await self._respond(writer, 405, "Method Not Allowed", {"Allow": "GET, HEAD"})
+                    continue
+                entry = self._lookup(target)
+                if not entry or not os.path.exists(entry.path):
+                    await self._respond(writer, 404, "Not Found")
+                    continue
+
+                if not await self._serve_file(writer, entry, method, headers.get("range"), keep_alive):
+                    break
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        except TransferCancelled:
+            logging.info("传输已取消，中止 HTTP 下载")
+        except Exception as e:
+            logging.error(f"HTTP 下载出错: {e}")
+        finally:
+            writer.close()
+
+    async def _serve_file(self, writer, entry, method, range_header, keep_alive):
+        size = entry.size
+        start, end = 0, size  # [start, end)
+        status, reason = 200, "OK"
+        extra = {}
+        if range_header:
+            m = _RANGE_RE.match(range_header.strip())
+            # 起点大于终点的无效区间 (bytes=10-5) 按 RFC 9110 忽略，返回整个文件
+            inverted = m and m.group(1) and m.group(2) and int(m.group(2)) < int(m.group(1))
+            if m and (m.group(1) or m.group(2)) and not inverted:
+                if m.group(1):
+                    start = int(m.group(1))
+                    end = min(int(m.group(2)) + 1, size) if m.group(2) else size
+                else:
+                    start = max(size - int(m.group(2)), 0)  # bytes=-N: 最后 N 字节
+                if start >= size or start >= end:
+                    await self._respond(writer, 416, "Range Not Satisfiable", {"Content-Range": f"bytes */{size}"})
+                    return True
+                status, reason = 206, "Partial Content"
+                extra["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+            # 多段 Range 等不支持的格式按 RFC 忽略，返回整个文件
+
+        head = {
+            "Content-Type": "application/octet-stream",
+            "Content-Length": str(end - start),
+            "Accept-Ranges": "bytes",
+            "Content-Disposition": f"attachment; filename*=UTF-8''{quote(entry.name)}",
+            "Connection": "keep-alive" if keep_alive else "close",
+        }
+        head.update(extra)
+        await self._respond(writer, status, reason, head, body=False)
+        if method == "HEAD" or end == start:
+            return True
+
+        loop = asyncio.get_running_loop()
+        pos = start
+        entry.active += 1
+        try:
+            with open(entry.path, "rb") as f:
+                while pos < end:
+                    n = min(SEND_CHUNK, end - pos)
+                    if entry.control:
+                        await self._throttle(entry.control, n)
+                    sent = await loop.sendfile(writer.transport, f, pos, n)
+                    entry.mark_served(pos, pos + sent)
+                    pos += sent
+                    if sent < n:
+                        break
+        finally:
+            entry.active -= 1
+            entry.expires = time.monotonic() + self.token_ttl
+        return pos == end
+
+    async def _throttle(self, control, n):
+        while True:
+            delay = control.poll_chunk(n)
+            if delay is not None:
+                break
+            await asyncio.sleep(0.2)  # 暂停中: 连接保持，继续后接着发送
+        if delay:
+            await asyncio.sleep(delay)
+
+    async def _respond(self, writer, status, reason, headers=None, body=True):
+        headers = dict(headers or {})
+        if body:
+            headers.setdefault("Content-Length", "0")
+        lines = [f"HTTP/1.1 {status} {reason}"] + [f"{k}: {v}" for k, v in headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        await writer.drain()
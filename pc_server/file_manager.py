@@ -4,13 +4,98 @@ import threading
 import uuid
 import logging
 import hashlib
+import time
+import re
+import base64
+import itertools
+from collections import deque
+
+from memory_budget import global_budget
+from transfer_queue import TransferCancelled, TransferPaused
+
+LEGACY_STREAM_THRESHOLD = 1024 * 1024  # 超过该长度的旧版 FILE_DATA 帧走流式解码
+_LEGACY_DATA_KEY = re.compile(r'"data"\s*:\s*"')
+
+
+def _pwrite(info, data, offset):
+    """按偏移写入，不依赖也不改变共享的文件位置 (多个分片并发写同一文件)"""
+    view = memoryview(data)
+    if hasattr(os, "pwrite"):
+        while view:
+            n = os.pwrite(info["fd"], view, offset)
+            view = view[n:]
+            offset += n
+    else:
+        # Windows 没有 os.pwrite: 加锁 seek + write
+        with info["lock"]:
+            os.lseek(info["fd"], offset, os.SEEK_SET)
+            while view:
+                n = os.write(info["fd"], view)
+                view = view[n:]
+
+def _add_range(ranges, start, end):
+    """把 [start, end) 并入按起点排序、互不重叠的区间列表，返回新列表"""
+    merged = []
+    for s, e in sorted(ranges + [(start, end)]):
+        if merged and s <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], e))
+        else:
+            merged.append((s, e))
+    return merged
+
+
+class _PriorityLock:
+    """
+    互斥锁，释放后交给等待者中优先级最高的 (同优先级先加入队列者优先)。
+    优先级在交接时才读取，等待期间调整任务优先级即时生效
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._held = False
+        self._waiters = {}  # 序号 -> transfer (None 为非队列发送，按优先级 0 计)
+        self._seq = itertools.count()
+
+    @staticmethod
+    def _rank(item):
+        seq, transfer = item
+        if transfer is None:
+            return (0, 0, -seq)
+        return (transfer.priority, -transfer.created, -seq)
+
+    def acquire(self, transfer=None):
+        """等待期间任务被暂停/取消时放弃等待，抛出 TransferPaused / TransferCancelled"""
+        with self._cond:
+            seq = next(self._seq)
+            self._waiters[seq] = transfer
+            try:
+                while self._held or max(self._waiters.items(), key=self._rank)[0] != seq:
+                    if transfer:
+                        transfer.before_chunk(0, yield_on_pause=True)
+                    self._cond.wait(0.2)
+            except BaseException:
+                del self._waiters[seq]
+                self._cond.notify_all()
+                raise
+            del self._waiters[seq]
+            self._held = True
+
+    def release(self):
+        with self._cond:
+            self._held = False
+            self._cond.notify_all()
+
 
 class FileManager:
-    def __init__(self, save_dir="received_files", send_callback=None, on_receive_complete=None, on_send_complete=None):
+    def __init__(self, save_dir="received_files", send_callback=None, on_receive_complete=None, on_send_complete=None,
+                 download_server=None, budget=None):
         self.save_dir = save_dir
         self.send_callback = send_callback # func(data) - str for JSON, bytes for binary
         self.on_receive_complete = on_receive_complete
         self.on_send_complete = on_send_complete
+        self.download_server = download_server  # v5.3: HTTP 下载旁路 (可选)
+        self.http_download = False  # 当前客户端是否支持 FILE_URL，由服务层按连接参数设置
+        self.budget = budget or global_budget
+        self.legacy_decode_chunk = 1024 * 1024  # 流式解码每块的 Base64 字符数 (4 的倍数)
         
         if not os.path.exists(self.save_dir):
             os.makedirs(self.save_dir)
@@ -28,6 +113,20 @@ class FileManager:
         self.bytes_since_last_ack = 0
         self.ack_threshold = 2 * 1024 * 1024  # 2MB
 
+        # 断线续传 (v5.3): 连接断开后保留未完成的传输，重连时按偏移继续
+        self.sending_files = {}
+        self.resume_timeout = 60  # 断开后等待重连续传的秒数
+        self._conn_gen = 0  # 每次建立连接 +1，用于发现发送途中发生过重连
+        self._connected = threading.Event()
+
+        # 多连接分片 (v5.3): 大文件拆成若干偏移区间，经多条并行连接传输
+        self.stripe_send = False  # 当前客户端是否支持分片接收，由服务层按连接参数设置
+        self.stripe_count = 4
+        self.stripe_min_size = 16 * 1024 * 1024  # 小文件不值得建多条连接
+        self.stripe_wait = 3  # 等待客户端建立分片连接的秒数，超时退回单连接
+        self.stripe_pipeline = 8  # 每条分片连接上允许的未完成发送数
+        self._stream_lock = _PriorityLock()
+
     def handle_binary(self, data):
         """处理接收到的二进制文件数据 (v5.0)"""
         if not self.current_receive_id:
@@ -43,23 +142,174 @@ class FileManager:
         if msg_type == "FILE_OFFER":
             name = data.get("name")
             size = data.get("size")
-            self._start_receive(file_id, name, size)
+            # stripes > 0: 数据经分片连接到达，主连接上不再有二进制帧
+            self._start_receive(file_id, name, size, striped=bool(data.get("stripes")))
             
         elif msg_type == "FILE_DATA":
             # 兼容旧版 Base64 模式 (来自 Android v4.x)
-            import base64
             b64_data = data.get("data")
             is_last = data.get("last", False)
             if b64_data:
                 raw = base64.b64decode(b64_data)
-                self._write_chunk_binary(file_id, raw, is_last)
+                self.budget.force(len(raw))
+                try:
+                    self._write_chunk_binary(file_id, raw, is_last)
+                finally:
+                    self.budget.release(len(raw))
             
         elif msg_type == "ACK":
             # Flow Control: Client finished writing/processing
             logging.info("收到 ACK，继续发送...")
             self.ack_event.set()
 
-    def _start_receive(self, file_id, name, size):
+        elif msg_type == "FILE_RESUME":
+            # 接收方 (手机) 重连后告知已收字节数，发送线程从该偏移继续
+            info = self.sending_files.get(file_id)
+            if info:
+                info["resume"] = (self._conn_gen, int(data.get("offset", 0)))
+                info["resume_event"].set()
+
+    def handle_legacy_frame(self, message):
+        """
+        超大的旧版 Base64 FILE_DATA 帧: 不整帧 json 解析、不整块解码，
+        定位 data 字段后逐块解码写入，额外内存只有一个块。
+        :return: False 表示不是可流式处理的 FILE_DATA 帧，调用方按普通消息处理
+        """
+        m = _LEGACY_DATA_KEY.search(message)
+        if not m: return False
+        start = m.end()
+        end = message.find('"', start)
+        # 含转义字符 (如 \/) 时无法按 4 字符对齐切块，交给普通路径
+        if end < 0 or message.find('\\', start, end) >= 0: return False
+        try:
+            meta = json.loads(message[:start] + message[end:])
+        except ValueError:
+            return False
+        if not isinstance(meta, dict) or meta.get("type") != "FILE_DATA": return False
+
+        file_id = meta.get("file_id")
+        is_last = meta.get("last", False)
+        pos = start
+        while pos < end:
+            piece = message[pos:min(pos + self.legacy_decode_chunk, end)]
+            pos += len(piece)
+            raw = base64.b64decode(piece)
+            self.budget.force(len(raw))
+            try:
+                self._write_chunk_binary(file_id, raw, is_last if pos >= end else False)
+            finally:
+                self.budget.release(len(raw))
+            if file_id not in self.receiving_files:
+                break  # 写入出错或已完成
+        return True
+
+    def wait_connected(self, timeout=None):
+        return self._connected.wait(timeout)
+
+    def set_connected(self, connected):
+        """由服务层在连接建立/断开时调用"""
+        if connected:
+            self._conn_gen += 1
+            self._connected.set()
+            self._expire_receives()
+        else:
+            self._connected.clear()
+
+    def transfer_state(self):
+        """未完成的传输列表，随 WELCOME 下发供客户端续传"""
+        return {
+            "sending": [{"file_id": fid, "name": info["name"], "size": info["size"]}
+                        for fid, info in list(self.sending_files.items())],
+            # striped: 分片接收只记录总字节数，无法按单一偏移续传，客户端需重新发送该文件
+            "receiving": [{"file_id": fid, "name": info["name"], "size": info["size"], "received": info["received"],
+                           "striped": bool(info.get("striped"))}
+                          for fid, info in list(self.receiving_files.items())],
+        }
+
+    def resume_receives(self):
+        """
+        重连后告知客户端各接收中文件的已收字节数，客户端从该偏移继续发送。
+        分片接收不参与: 各区间进度不同，汇总的字节数不是有效偏移，且主连接上的二进制帧不能写入预分配的文件
+        """
+        for file_id, info in list(self.receiving_files.items()):
+            if info.get("striped"):
+                continue
+            self.current_receive_id = file_id
+            self.bytes_since_last_ack = 0
+            info["last_active"] = time.monotonic()
+            self.send_callback(json.dumps({"type": "FILE_RESUME", "file_id": file_id, "offset": info["received"]}))
+            logging.info(f"续传接收: {info['name']} 从 {info['received']} 字节继续")
+
+    def _expire_receives(self):
+        """放弃超过 resume_timeout 仍未续传的半截文件"""
+        now = time.monotonic()
+        for file_id, info in list(self.receiving_files.items()):
+            if now - info["last_active"] > self.resume_timeout:
+                logging.warning(f"续传超时，放弃接收: {info['name']}")
+                self._cleanup_receive(file_id, remove_partial=True)
+
+    def attach_stripe(self, file_id, send):
+        """
+        客户端为某个文件建立的分片连接 (ws://ip:8765/?stripe=<file_id>)
+        :param send: func(data) -> future，在该连接上发送
+        :return: 分片状态 (之后交给 handle_stripe)；file_id 未知或区间已分配完毕时返回 None
+        """
+        stripe = {"file_id": file_id, "send": send, "pos": None, "end": 0, "unacked": 0}
+        info = self.sending_files.get(file_id)
+        if info is not None and "stripes" in info:
+            with info["stripe_lock"]:
+                if info["stripes_assigned"]:
+                    return None  # 区间已分配完毕，迟到的连接拿不到区间，直接拒绝
+                info["stripes"].append(stripe)
+            info["stripe_event"].set()
+            return stripe
+        info = self.receiving_files.get(file_id)
+        if info is not None and info.get("striped"):
+            return stripe
+        return None
+
+    def handle_stripe(self, stripe, message):
+        """分片连接上的接收数据: 文本帧为 STRIPE 头 (偏移/长度)，二进制帧写入当前偏移"""
+        file_id = stripe["file_id"]
+        info = self.receiving_files.get(file_id)
+        if not info: return
+
+        if isinstance(message, str):
+            try:
+                header = json.loads(message)
+            except ValueError:
+                return
+            if isinstance(header, dict) and header.get("type") == "STRIPE":
+                stripe["pos"] = int(header.get("offset", 0))
+                stripe["end"] = min(stripe["pos"] + int(header.get("length", 0)), info["size"])
+            return
+
+        if stripe["pos"] is None or stripe["pos"] + len(message) > stripe["end"]:
+            logging.warning(f"分片数据超出声明的区间，已丢弃: {info['name']}")
+            return
+        try:
+            _pwrite(info, message, stripe["pos"])
+        except OSError as e:
+            logging.error(f"写入文件出错: {e}")
+            self._cleanup_receive(file_id, remove_partial=True)
+            return
+
+        # 按区间记录已写入的数据: 客户端重发或分片区间重叠时不会重复计数
+        info["ranges"] = _add_range(info["ranges"], stripe["pos"], stripe["pos"] + len(message))
+        info["received"] = sum(e - s for s, e in info["ranges"])
+        stripe["pos"] += len(message)
+        stripe["unacked"] += len(message)
+        info["last_active"] = time.monotonic()
+        if stripe["unacked"] >= self.ack_threshold or stripe["pos"] == stripe["end"]:
+            stripe["send"](json.dumps({"type": "ACK", "file_id": file_id, "offset": stripe["pos"]}))
+            stripe["unacked"] = 0
+        if info["ranges"][0] == (0, info["size"]):
+            self._finish_receive(file_id)
+
+    def _start_receive(self, file_id, name, size, striped=False):
+        if file_id in self.receiving_files:
+            # 客户端重新发起同一文件 (未走续传)，丢弃旧的半截文件
+            self._cleanup_receive(file_id, remove_partial=True)
         try:
             safe_name = os.path.basename(name)
             path = os.path.join(self.save_dir, safe_name)
@@ -71,16 +321,23 @@ class FileManager:
                 counter += 1
                 
             f = open(path, 'wb')
-            self.receiving_files[file_id] = {
+            info = {
                 "handle": f,
                 "name": os.path.basename(path),
                 "path": path,
                 "size": size,
-                "received": 0
+                "received": 0,
+                "last_active": time.monotonic()
             }
-            self.current_receive_id = file_id
-            self.bytes_since_last_ack = 0
-            logging.info(f"开始接收文件 (Binary): {name} -> {path}")
+            if striped:
+                # 预分配文件大小，各分片按偏移直接写入
+                f.truncate(size)
+                info.update({"striped": True, "fd": f.fileno(), "lock": threading.Lock(), "ranges": []})
+            self.receiving_files[file_id] = info
+            if not striped:
+                self.current_receive_id = file_id
+                self.bytes_since_last_ack = 0
+            logging.info(f"开始接收文件 ({'分片' if striped else 'Binary'}): {name} -> {path}")
         except Exception as e:
             logging.error(f"无法创建文件 {name}: {e}")
 
@@ -91,6 +348,7 @@ class FileManager:
         try:
             info["handle"].write(raw_data)
             info["received"] += len(raw_data)
+            info["last_active"] = time.monotonic()
             
             # Flow Control: Send ACK?
             self.bytes_since_last_ack += len(raw_data)
@@ -102,40 +360,58 @@ class FileManager:
             # Check EOF (for legacy mode with is_last, or size-based)
             is_done = is_last_override if is_last_override is not None else (info["received"] >= info["size"])
             if is_done:
-                info["handle"].close()
-                filename = info["name"]
-                path = info["path"]
-                del self.receiving_files[file_id]
-                self.current_receive_id = None
-                
-                # Final ACK
-                ack_msg = {"type": "ACK", "file_id": file_id, "received": info["received"]}
-                self.send_callback(json.dumps(ack_msg))
-                
-                logging.info(f"文件接收完成: {filename}")
-                if self.on_receive_complete:
-                    self.on_receive_complete(path)
+                self._finish_receive(file_id)
                     
         except Exception as e:
             logging.error(f"写入文件出错: {e}")
             self._cleanup_receive(file_id)
 
-    def _cleanup_receive(self, file_id):
+    def _finish_receive(self, file_id):
+        info = self.receiving_files.pop(file_id)
+        info["handle"].close()
+        if self.current_receive_id == file_id:
+            self.current_receive_id = None
+
+        # Final ACK
+        ack_msg = {"type": "ACK", "file_id": file_id, "received": info["received"]}
+        self.send_callback(json.dumps(ack_msg))
+
+        logging.info(f"文件接收完成: {info['name']}")
+        if self.on_receive_complete:
+            self.on_receive_complete(info["path"])
+
+    def _cleanup_receive(self, file_id, remove_partial=False):
         info = self.receiving_files.get(file_id)
         if info:
             if info.get("handle"): info["handle"].close()
             del self.receiving_files[file_id]
+            if remove_partial:
+                try:
+                    os.remove(info["path"])
+                except OSError:
+                    pass
         if self.current_receive_id == file_id:
             self.current_receive_id = None
 
     def send_file_thread(self, filepath):
         """在独立线程中发送文件"""
-        threading.Thread(target=self._send_worker, args=(filepath,), daemon=True).start()
+        threading.Thread(target=self.send_file, args=(filepath,), daemon=True).start()
 
-    def _send_worker(self, filepath):
-        if not os.path.exists(filepath): return
+    def send_file(self, filepath, transfer=None):
+        """
+        发送文件，阻塞直到完成或失败
+        :param transfer: 可选的传输控制 (transfer_queue.Transfer)。每块数据发送前调用
+                         transfer.before_chunk(n) 做限速/暂停/取消，发送后调用 transfer.on_progress(n)。
+                         持有单连接发送锁时暂停会抛出 TransferPaused，取消抛出 TransferCancelled。
+                         取得发送通道、真正开始发送时调用 transfer.on_start()
+        :return: 是否发送成功
+        """
+        if self.download_server and self.http_download:
+            return self._publish_file(filepath, transfer)
+        if not os.path.exists(filepath): return False
         
-        file_id = str(uuid.uuid4())
+        # 队列任务沿用任务 id: 暂停后重新发送时，接收方收到同一 file_id 的 FILE_OFFER 会丢弃半截文件
+        file_id = transfer.id if transfer else str(uuid.uuid4())
         filename = os.path.basename(filepath)
         size = os.path.getsize(filepath)
         
@@ -146,22 +422,64 @@ class FileManager:
             "name": filename,
             "size": size
         }
-        self.send_callback(json.dumps(offer))
-        logging.info(f"发送 FILE_OFFER: {filename}, {size} bytes")
+        info = {"name": filename, "size": size, "resume": None, "resume_event": threading.Event()}
+        striped = self.stripe_send and size >= self.stripe_min_size
+        if striped:
+            offer["stripes"] = self.stripe_count
+            info.update({"stripes": [], "stripe_event": threading.Event(), "stripe_lock": threading.Lock(),
+                         "stripes_assigned": False})
+        else:
+            # 手机端把主连接上的二进制帧写入最近一个 FILE_OFFER，单连接发送必须逐个进行 (按优先级轮流)
+            self._stream_lock.acquire(transfer)
+        locked = not striped
+        self.sending_files[file_id] = info
         
-        # Small delay to let receiver prepare
-        import time
-        time.sleep(0.2)
-        
-        # 2. Binary Data Loop with simple throttling (no ACK dependency)
         try:
+            if transfer:
+                transfer.before_chunk(0, yield_on_pause=True)  # 排队等待期间可能已被取消/暂停
+                transfer.on_start()
+            gen = self._conn_gen
+            self.send_callback(json.dumps(offer))
+            logging.info(f"发送 FILE_OFFER: {filename}, {size} bytes")
+            
+            # Small delay to let receiver prepare
+            time.sleep(0.2)
+            
+            # 2. Binary Data Loop with simple throttling (no ACK dependency)
+            if striped:
+                stripes = self._wait_stripes(info, offer["stripes"])
+                if stripes:
+                    self._send_striped(filepath, file_id, info, stripes, transfer)
+                    logging.info(f"文件发送完毕: {filename} ({len(stripes)} 路分片)")
+                    if self.on_send_complete:
+                        self.on_send_complete(filename)
+                    return True
+                logging.warning("客户端未建立分片连接，退回单连接发送")
+                self._stream_lock.acquire(transfer)
+                locked = True
+
             with open(filepath, 'rb') as f:
                 while True:
+                    if gen != self._conn_gen or not self._connected.is_set():
+                        # 发送途中断线：等待客户端重连并告知已收字节数
+                        offset = self._wait_resume(info)
+                        if offset is None:
+                            raise ConnectionError("连接断开，续传超时")
+                        gen = self._conn_gen
+                        if transfer:
+                            transfer.on_progress(offset - f.tell())
+                        f.seek(offset)
+                        logging.info(f"续传发送: {filename} 从 {offset} 字节继续")
+
+                    if transfer:
+                        transfer.before_chunk(self.chunk_size, yield_on_pause=locked)
                     chunk = f.read(self.chunk_size)
                     if not chunk: break
                     
                     # Send Binary Frame
                     self.send_callback(chunk)
+                    if transfer:
+                        transfer.on_progress(len(chunk))
                     
                     # Simple throttle: 1ms per 64KB ≈ 64MB/s max
                     time.sleep(0.001)
@@ -169,6 +487,130 @@ class FileManager:
             logging.info(f"文件发送完毕: {filename}")
             if self.on_send_complete:
                 self.on_send_complete(filename)
+            return True
 
+        except (TransferCancelled, TransferPaused):
+            raise
         except Exception as e:
             logging.error(f"发送文件中断: {filepath}, {e}")
+            return False
+        finally:
+            self.sending_files.pop(file_id, None)
+            if locked:
+                self._stream_lock.release()
+
+    def _publish_file(self, filepath, transfer=None):
+        """
+        HTTP 旁路: 发布下载链接，由客户端通过 HTTP (支持 Range) 拉取。
+        队列任务阻塞到客户端下载完整个文件，下载过程同样受 transfer 的限速/暂停/取消控制；
+        链接长时间无人访问而失效时返回 False
+        """
+        if not os.path.exists(filepath): return False
+
+        file_id = transfer.id if transfer else str(uuid.uuid4())
+        filename = os.path.basename(filepath)
+        downloaded = threading.Event()
+
+        def on_complete():
+            downloaded.set()
+            if self.on_send_complete:
+                self.on_send_complete(filename)
+
+        path = self.download_server.publish(filepath, on_complete=on_complete, control=transfer)
+        offer = {
+            "type": "FILE_URL",
+            "file_id": file_id,
+            "name": filename,
+            "size": os.path.getsize(filepath),
+            "port": self.download_server.port,
+            "path": path,
+            "expires_in": self.download_server.token_ttl
+        }
+        self.send_callback(json.dumps(offer))
+        logging.info(f"发送 FILE_URL: {filename}")
+        if not transfer:
+            return True
+
+        transfer.on_start()
+        try:
+            while not downloaded.wait(0.5):
+                transfer.before_chunk(0)  # 暂停时原地等待 (不占发送通道)，取消时抛出 TransferCancelled
+                if not self.download_server.is_published(path):
+                    logging.warning(f"下载链接已失效，客户端未下载: {filename}")
+                    return False
+            return True
+        finally:
+            if not downloaded.is_set():
+                self.download_server.unpublish(path)
+
+    def _wait_stripes(self, info, count):
+        """
+        等待客户端建立 count 条分片连接，最多 stripe_wait 秒。
+        返回时区间分配即告截止，之后到达的分片连接由 attach_stripe 拒绝。
+        :return: 已建立的分片连接 (可能少于 count，为空时调用方退回单连接)
+        """
+        deadline = time.monotonic() + self.stripe_wait
+        while True:
+            with info["stripe_lock"]:
+                remaining = deadline - time.monotonic()
+                if len(info["stripes"]) >= count or remaining <= 0:
+                    info["stripes_assigned"] = True
+                    return list(info["stripes"])
+            info["stripe_event"].wait(remaining)
+            info["stripe_event"].clear()
+
+    def _send_striped(self, filepath, file_id, info, stripes, transfer=None):
+        """把文件按偏移均分给已建立的分片连接，每条连接一个线程并行发送"""
+        size = info["size"]
+        step = -(-size // len(stripes))
+        errors = []
+
+        def worker(stripe, offset, length):
+            pending = deque()
+            try:
+                header = {"type": "STRIPE", "file_id": file_id, "offset": offset, "length": length}
+                pending.append(stripe["send"](json.dumps(header)))
+                with open(filepath, 'rb') as f:
+                    f.seek(offset)
+                    remaining = length
+                    while remaining > 0:
+                        if transfer:
+                            transfer.before_chunk(min(self.chunk_size, remaining))
+                        chunk = f.read(min(self.chunk_size, remaining))
+                        if not chunk:
+                            raise IOError("文件在发送过程中被截断")
+                        pending.append(stripe["send"](chunk))
+                        remaining -= len(chunk)
+                        if transfer:
+                            transfer.on_progress(len(chunk))
+                        # 限制在途数量，等最早的发送完成 (也起到背压作用)
+                        while len(pending) > self.stripe_pipeline:
+                            pending.popleft().result()
+                while pending:
+                    pending.popleft().result()
+            except Exception as e:
+                errors.append(e)
+
+        threads = []
+        for i, stripe in enumerate(stripes):
+            offset = i * step
+            length = max(0, min(step, size - offset))
+            t = threading.Thread(target=worker, args=(stripe, offset, length), daemon=True)
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+        if errors:
+            raise errors[0]
+
+    def _wait_resume(self, info):
+        """等待重连后的 FILE_RESUME，返回续传偏移；超时返回 None"""
+        deadline = time.monotonic() + self.resume_timeout
+        while time.monotonic() < deadline:
+            resume = info["resume"]
+            if resume and resume[0] == self._conn_gen and self._connected.is_set():
+                info["resume"] = None
+                return resume[1]
+            info["resume_event"].wait(0.2)
+            info["resume_event"].clear()
+        return None
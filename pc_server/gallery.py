@@ -0,0 +1,257 @@
+import logging
+import os
+import tkinter as tk
+from collections import OrderedDict
+
+CELL_W = 150
+CELL_H = 170
+THUMB_H = 130
+MAX_IMAGES = 400  # 内存中保留的 PhotoImage 数量上限
+
+
+class GalleryWindow(tk.Toplevel):
+    """
+    接收文件图库: 网格显示 received_files，图片显示缩略图，其他文件显示扩展名。
+    只为可见区域内的格子创建画布元素和加载缩略图 (虚拟化)，数千个文件也能立即打开；
+    已缓存的缩略图直接从 ThumbnailCache 读取 PNG，未缓存的先显示占位并在后台生成。
+    双击打开文件。
+    """
+    def __init__(self, root, folder, thumbnails, focus_path=None):
+        """
+        :param thumbnails: thumbnail_cache.ThumbnailCache
+        :param focus_path: 打开后滚动到并选中的文件
+        """
+        super().__init__(root)
+        self.title("接收文件")
+        self.geometry("680x520")
+        self.folder = os.path.abspath(folder)
+        self.thumbnails = thumbnails
+        self.files = []  # [(path, stat)]，最新的在前
+        self.selected = None
+        self._images = OrderedDict()  # thumb_path -> PhotoImage (LRU)
+        self._drawn = {}  # 文件序号 -> [画布元素]
+        self._columns = 1
+        self._render_pending = False
+        self._closed = False
+
+        bar = tk.Frame(self)
+        bar.pack(fill=tk.X)
+        self.lbl_count = tk.Label(bar, fg="gray")
+        self.lbl_count.pack(side=tk.LEFT, padx=10, pady=4)
+        tk.Button(bar, text="刷新", command=self.reload).pack(side=tk.RIGHT, padx=5, pady=4)
+        tk.Button(bar, text="打开文件夹", command=lambda: _open_path(self.folder)).pack(side=tk.RIGHT, pady=4)
+
+        self.canvas = tk.Canvas(self, bg="white", highlightthickness=0)
+        scrollbar = tk.Scrollbar(self, command=self._yview)
+        self.canvas.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.canvas.pack(fill=tk.BOTH, expand=True)
+
+        self.canvas.bind("<Configure>", lambda e: self._layout())
+        self.canvas.bind("<MouseWheel>", self._on_wheel)
+        self.canvas.bind("<Button-4>", lambda e: self._yview("scroll", -1, "units"))
+        self.canvas.bind("<Button-5>", lambda e: self._yview("scroll", 1, "units"))
+        self.canvas.bind("<Button-1>", self._on_click)
+        self.canvas.bind("<Double-Button-1>", self._on_double_click)
+        self.protocol("WM_DELETE_WINDOW", self.close)
+
+        self.update_idletasks()  # 先确定画布宽度，列数正确后才能滚动到 focus_path
+        self.reload(focus_path)
+
+    # ---- 数据 ----
+
+    def reload(self, focus_path=None):
+        """重新扫描文件夹 (只 stat，不读取文件内容)"""
+        files = []
+        try:
+            with os.scandir(self.folder) as it:
+                for entry in it:
+                    try:
+                        if entry.is_file():
+                            files.append((entry.path, entry.stat()))
+                    except OSError:
+                        pass
+        except OSError as e:
+            logging.error(f"读取接收文件夹失败: {e}")
+        files.sort(key=lambda item: item[1].st_mtime, reverse=True)
+        self.files = files
+        self.lbl_count.config(text=f"{len(files)} 个文件")
+        self._clear()
+        self._layout()
+        if focus_path:
+            self.focus_file(focus_path)
+
+    def add_file(self, path):
+        """新文件接收完成 (界面线程调用)"""
+        path = os.path.abspath(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        self.files = [(p, s) for p, s in self.files if os.path.abspath(p) != path]
+        self.files.insert(0, (path, st))
+        self.lbl_count.config(text=f"{len(self.files)} 个文件")
+        self._clear()
+        self._layout()
+
+    def focus_file(self, path):
+        path = os.path.abspath(path)
+        for i, (p, _) in enumerate(self.files):
+            if os.path.abspath(p) == path:
+                self.selected = i
+                row = i // self._columns
+                total = max(1, (len(self.files) + self._columns - 1) // self._columns)
+                self.canvas.yview_moveto(row / total)
+                self._clear()
+                self._schedule_render()
+                return
+
+    def close(self):
+        self._closed = True
+        self._images.clear()
+        self.destroy()
+
+    # ---- 绘制 ----
+
+    def _layout(self):
+        width = max(self.canvas.winfo_width(), CELL_W)
+        columns = max(1, width // CELL_W)
+        if columns != self._columns:
+            self._columns = columns
+            self._clear()
+        rows = (len(self.files) + columns - 1) // columns
+        self.canvas.configure(scrollregion=(0, 0, columns * CELL_W, max(rows * CELL_H, 1)))
+        self._schedule_render()
+
+    def _clear(self):
+        self.canvas.delete("all")
+        self._drawn.clear()
+
+    def _yview(self, *args):
+        self.canvas.yview(*args)
+        self._schedule_render()
+
+    def _on_wheel(self, event):
+        self._yview("scroll", -1 if event.delta > 0 else 1, "units")
+
+    def _schedule_render(self):
+        # 滚动事件很密集，合并到下一次空闲时绘制
+        if not self._render_pending and not self._closed:
+            self._render_pending = True
+            self.after_idle(self._render_visible)
+
+    def _visible_range(self):
+        top = self.canvas.canvasy(0)
+        bottom = top + self.canvas.winfo_height()
+        first = max(0, int(top // CELL_H) - 1) * self._columns
+        last = min(len(self.files), (int(bottom // CELL_H) + 2) * self._columns)
+        return first, last
+
+    def _render_visible(self):
+        self._render_pending = False
+        if self._closed:
+            return
+        first, last = self._visible_range()
+        # 移出可见区域的格子删除画布元素，保持元素数量有界
+        for i in [i for i in self._drawn if i < first or i >= last]:
+            for item in self._drawn.pop(i):
+                self.canvas.delete(item)
+        for i in range(first, last):
+            if i not in self._drawn:
+                self._draw_cell(i)
+
+    def _draw_cell(self, i):
+        path, st = self.files[i]
+        x = (i % self._columns) * CELL_W
+        y = (i // self._columns) * CELL_H
+        cx = x + CELL_W // 2
+        items = []
+        if i == self.selected:
+            items.append(self.canvas.create_rectangle(x + 2, y + 2, x + CELL_W - 2, y + CELL_H - 2,
+                                                      outline="#2196F3", fill="#E3F2FD"))
+        image = self._thumbnail_image(path, st, i)
+        if image is not None:
+            items.append(self.canvas.create_image(cx, y + 5 + THUMB_H // 2, image=image))
+        else:
+            ext = os.path.splitext(path)[1].upper().lstrip(".") or "FILE"
+            items.append(self.canvas.create_rectangle(cx - 40, y + 25, cx + 40, y + 115, outline="#BDBDBD", fill="#F5F5F5"))
+            items.append(self.canvas.create_text(cx, y + 70, text=ext[:6], fill="#757575"))
+        name = os.path.basename(path)
+        if len(name) > 20:
+            name = name[:9] + "…" + name[-9:]
+        items.append(self.canvas.create_text(cx, y + THUMB_H + 20, text=name, width=CELL_W - 10))
+        self._drawn[i] = items
+
+    def _thumbnail_image(self, path, st, index):
+        if not self.thumbnails.is_image(path):
+            return None
+        thumb = self.thumbnails.lookup(path, st)
+        if thumb is None:
+            self.thumbnails.request(path, lambda p, t: self._on_thumbnail_ready(index, p))
+            return None
+        if not thumb:
+            return None  # 无法解码，按普通文件显示
+        image = self._images.get(thumb)
+        if image is not None:
+            self._images.move_to_end(thumb)
+            return image
+        try:
+            image = tk.PhotoImage(file=thumb, master=self)
+        except tk.TclError:
+            # 缩略图文件丢失或损坏: 重新生成
+            self.thumbnails.request(path, lambda p, t: self._on_thumbnail_ready(index, p))
+            return None
+        self._images[thumb] = image
+        while len(self._images) > MAX_IMAGES:
+            self._images.popitem(last=False)
+        return image
+
+    def _on_thumbnail_ready(self, index, path):
+        # 来自进程池回调线程，切回界面线程重绘该格子
+        if self._closed:
+            return
+        try:
+            self.after(0, lambda: self._redraw(index, path))
+        except (RuntimeError, tk.TclError):
+            pass
+
+    def _redraw(self, index, path):
+        if self._closed or index >= len(self.files) or self.files[index][0] != path:
+            return
+        for item in self._drawn.pop(index, []):
+            self.canvas.delete(item)
+        first, last = self._visible_range()
+        if first <= index < last:
+            self._draw_cell(index)
+
+    # ---- 交互 ----
+
+    def _index_at(self, event):
+        x = self.canvas.canvasx(event.x)
+        y = self.canvas.canvasy(event.y)
+        col = int(x // CELL_W)
+        if col >= self._columns:
+            return None
+        i = int(y // CELL_H) * self._columns + col
+        return i if 0 <= i < len(self.files) else None
+
+    def _on_click(self, event):
+        i = self._index_at(event)
+        previous, self.selected = self.selected, i
+        for j in (previous, i):
+            if j is not None and j in self._drawn:
+                for item in self._drawn.pop(j):
+                    self.canvas.delete(item)
+                self._draw_cell(j)
+
+    def _on_double_click(self, event):
+        i = self._index_at(event)
+        if i is not None:
+            _open_path(self.files[i][0])
+
+
+def _open_path(path):
+    try:
+        os.startfile(os.path.abspath(path))
+    except (AttributeError, OSError) as e:
+        logging.error(f"无法打开 {path}: {e}")
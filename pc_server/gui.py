@@ -0,0 +1,499 @@
+import threading
+import tkinter as tk
+from tkinter import scrolledtext, ttk
+import logging
+import sys
+import os
+from tkinter import filedialog
+
+from service import Phone2PCService
+from log_sink import LogSink
+from discovery import get_local_addresses
+
+# 注意: winreg / PIL / pystray / windnd / 图库 均在首次使用时才导入，避免拖慢启动
+
+def resource_path(relative_path):
+    """ Get absolute path to resource, works for dev and for PyInstaller """
+    try:
+        # PyInstaller creates a temp folder and stores path in _MEI
+        base_path = sys._MEIPASS
+    except Exception:
+        base_path = os.path.abspath(".")
+
+    return os.path.join(base_path, relative_path)
+
+class AppGUI:
+    def __init__(self, root):
+        self.root = root
+        self.root.title("Phone2PC 智连 (v5.2.2)")
+        self.root.geometry("500x600")
+        
+        # 启动时最小化到通知区域 (隐藏窗口)
+        self.root.withdraw()
+        
+        # 设置窗口图标 (Runtime)
+        try:
+            icon_path = resource_path("pc_server/icon.ico")
+            if not os.path.exists(icon_path):
+                 # Try local dev path if not in bundled subfolder
+                 icon_path = resource_path("icon.ico")
+            
+            if os.path.exists(icon_path):
+                self.root.iconbitmap(icon_path)
+            else:
+                 # Fallback: check if in current dir directly (dev)
+                 if os.path.exists("pc_server/icon.ico"):
+                     self.root.iconbitmap("pc_server/icon.ico")
+        except Exception as e:
+            logging.error(f"Failed to set icon: {e}")
+        
+        self.tray_icon = None
+        self.log_sink = None
+        self._queue_refresh_pending = False
+        self.is_closing = False
+        self.thumbnails = None
+        self.gallery = None
+        self._file_list_paths = []  # 与 list_files 各行对应的文件路径 (发送记录为 None)
+
+        self.service = Phone2PCService(
+            host="0.0.0.0",
+            port=8765,
+            save_dir="received_files",
+            on_pc_clipboard_change=lambda text: self.root.after(0, lambda: self._update_list("pc")),
+            on_phone_clipboard_change=lambda text: self.root.after(0, lambda: self._update_list("phone")),
+            on_file_received=self._on_file_received,
+            on_file_sent=self._on_file_sent_success,
+            on_transfer_update=self._on_transfer_update
+        )
+        self.clipboard_manager = self.service.clipboard_manager
+        self.file_manager = self.service.file_manager
+
+        self._init_ui()
+        
+        self.root.protocol("WM_DELETE_WINDOW", self._on_close_click)
+        
+        # 服务端各组件在后台线程并发启动，不再分步延时
+        self._start_server_safe()
+        self._start_ip_check()
+        self.root.after(0, self._init_autorun_state)
+        self.root.after(0, self._init_drag_drop)
+        threading.Thread(target=self._init_tray_safe, daemon=True).start()
+
+    def _init_ui(self):
+        self.notebook = ttk.Notebook(self.root)
+        self.notebook.pack(fill=tk.BOTH, expand=True)
+
+        # Tab 1: 主页
+        self.tab_home = tk.Frame(self.notebook)
+        self.notebook.add(self.tab_home, text="  主页  ")
+        self._init_home_tab(self.tab_home)
+
+        # Tab 2: 云剪贴板
+        self.tab_clipboard = tk.Frame(self.notebook)
+        self.notebook.add(self.tab_clipboard, text="  云剪贴板  ")
+        self._init_clipboard_tab(self.tab_clipboard)
+        
+        # Tab 3: 文件传输
+        self.tab_files = tk.Frame(self.notebook)
+        self.notebook.add(self.tab_files, text="  文件传输  ")
+        self._init_file_tab(self.tab_files)
+
+    def _init_home_tab(self, parent):
+        # 顶部框架 (IP & Checkbox)
+        top_frame = tk.Frame(parent, pady=15)
+        top_frame.pack(fill=tk.X, padx=15)
+        
+        # IP 显示
+        tk.Label(top_frame, text="本机 IP:", font=("Arial", 11, "bold")).pack(side=tk.LEFT)
+        self.ip_entry = tk.Entry(top_frame, font=("Arial", 11), width=15, fg="blue")
+        self.ip_entry.pack(side=tk.LEFT, padx=5)
+        self.ip_entry.insert(0, "正在检测...")
+        self.ip_entry.configure(state='readonly')
+
+        # 开机自启 Checkbox
+        # 初始设为 False，稍后异步更新，避免阻塞 UI
+        self.autorun_var = tk.BooleanVar(value=False)
+        cb_autorun = tk.Checkbutton(top_frame, text="开机自启", variable=self.autorun_var, command=self._toggle_autorun)
+        cb_autorun.pack(side=tk.RIGHT)
+
+        # 诊断: 运行中随时开关，无需重启
+        diag_frame = tk.Frame(parent)
+        diag_frame.pack(fill=tk.X, padx=15)
+        self.watchdog_var = tk.BooleanVar(value=self.service.diagnostics.watchdog_enabled)
+        tk.Checkbutton(diag_frame, text="卡顿检测", variable=self.watchdog_var, command=self._toggle_watchdog).pack(side=tk.LEFT)
+        self.btn_profile = tk.Button(diag_frame, text="采样分析 10 秒", command=self._start_profile)
+        self.btn_profile.pack(side=tk.RIGHT)
+
+        # 日志区域
+        log_frame = tk.LabelFrame(parent, text="运行日志", padx=5, pady=5)
+        log_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+
+        self.log_text = scrolledtext.ScrolledText(log_frame, state='disabled', height=10)
+        self.log_text.pack(fill=tk.BOTH, expand=True)
+
+        self._setup_logging()
+        
+        # v5.0 Status Label
+        tk.Label(parent, text="v5.0 已就绪 | 二进制+流控", fg="gray").pack(pady=5)
+
+    def _toggle_watchdog(self):
+        if self.watchdog_var.get():
+            self.service.diagnostics.enable_watchdog()
+        else:
+            self.service.diagnostics.disable_watchdog()
+
+    def _start_profile(self):
+        # 结果为折叠栈 (.folded)，可用 flamegraph.pl 或 speedscope 打开
+        self.btn_profile.config(state=tk.DISABLED, text="采样中...")
+        self.service.diagnostics.profile_for(10, on_done=lambda path: self.root.after(0, self._on_profile_done))
+
+    def _on_profile_done(self):
+        self.btn_profile.config(state=tk.NORMAL, text="采样分析 10 秒")
+
+    def _init_clipboard_tab(self, parent):
+        # 左右分栏：左边本机历史，右边手机历史
+        paned = tk.PanedWindow(parent, orient=tk.HORIZONTAL)
+        paned.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+
+        # 左栏：PC 剪贴板
+        left_frame = tk.LabelFrame(paned, text="PC 剪贴板历史 (点击复制)")
+        paned.add(left_frame, minsize=200)
+        
+        self.list_pc = tk.Listbox(left_frame, selectmode=tk.SINGLE)
+        self.list_pc.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        self.list_pc.bind("<<ListboxSelect>>", self._on_pc_list_click)
+        
+        btn_clear_pc = tk.Button(left_frame, text="清空列表", command=lambda: self._clear_list("pc"))
+        btn_clear_pc.pack(fill=tk.X, padx=5, pady=2)
+
+        # 右栏：手机 剪贴板
+        right_frame = tk.LabelFrame(paned, text="手机 剪贴板历史 (点击复制)")
+        paned.add(right_frame, minsize=200)
+
+        self.list_phone = tk.Listbox(right_frame, selectmode=tk.SINGLE)
+        self.list_phone.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        self.list_phone.bind("<<ListboxSelect>>", self._on_phone_list_click)
+
+        btn_clear_phone = tk.Button(right_frame, text="清空列表", command=lambda: self._clear_list("phone"))
+        btn_clear_phone.pack(fill=tk.X, padx=5, pady=2)
+
+    def _init_file_tab(self, parent):
+        # 顶部提示
+        lbl_hint = tk.Label(parent, text="支持拖拽文件到此窗口直接发送", fg="gray", pady=10)
+        lbl_hint.pack()
+
+        # 发送按钮
+        btn_send = tk.Button(parent, text="选择文件发送", command=self._select_file_to_send, bg="#E1F5FE", height=2)
+        btn_send.pack(fill=tk.X, padx=20, pady=5)
+
+        # 发送队列 (实时进度)
+        queue_frame = tk.LabelFrame(parent, text="发送队列", padx=5, pady=5)
+        queue_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+
+        columns = ("name", "progress", "speed", "status")
+        self.tree_queue = ttk.Treeview(queue_frame, columns=columns, show="headings", height=6)
+        for col, text, width in (("name", "文件", 200), ("progress", "进度", 70), ("speed", "速度", 80), ("status", "状态", 60)):
+            self.tree_queue.heading(col, text=text)
+            self.tree_queue.column(col, width=width, anchor=tk.W if col == "name" else tk.CENTER)
+        self.tree_queue.pack(fill=tk.BOTH, expand=True)
+
+        btn_bar = tk.Frame(queue_frame)
+        btn_bar.pack(fill=tk.X, pady=(5, 0))
+        for text, command in (("暂停", self._pause_selected), ("继续", self._resume_selected),
+                              ("取消", self._cancel_selected), ("优先", self._prioritize_selected),
+                              ("清除已完成", self._clear_finished)):
+            tk.Button(btn_bar, text=text, command=command).pack(side=tk.LEFT, expand=True, fill=tk.X, padx=2)
+        self.root.after(0, self._refresh_queue)
+        
+        # 接收记录
+        tk.Label(parent, text="v5.0 已就绪 | 二进制+流控", fg="gray").pack(fill=tk.X, padx=10, pady=5)
+        
+        self.list_files = tk.Listbox(parent, selectmode=tk.SINGLE, height=8)
+        self.list_files.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        self.list_files.bind("<Double-Button-1>", self._on_file_list_double_click)
+        
+        dir_bar = tk.Frame(parent)
+        dir_bar.pack(fill=tk.X, padx=10, pady=5)
+        tk.Button(dir_bar, text="图库", command=self._open_gallery).pack(side=tk.LEFT, expand=True, fill=tk.X, padx=(0, 2))
+        tk.Button(dir_bar, text="打开接收文件夹", command=self._open_recv_dir).pack(side=tk.LEFT, expand=True, fill=tk.X, padx=(2, 0))
+
+    def _init_drag_drop(self):
+        # Hook Drag & Drop
+        try:
+            import windnd
+            windnd.hook_dropfiles(self.root, func=self._on_drop_files)
+            logging.info("文件拖拽功能已启用")
+        except Exception as e:
+            logging.error(f"拖拽初始化失败: {e}")
+
+    def _on_drop_files(self, filenames):
+        if not filenames: return
+        # windnd 返回的是 bytes 列表 (Windows ANSI), 需解码? 
+        # 文档说通常是 list of bytes. 
+        # 测试中 windnd 1.0.7 可能返回 bytes. 需处理 decoding.
+        
+        files_to_send = []
+        for f in filenames:
+            if isinstance(f, bytes):
+                f = f.decode("gbk") # Windows 路径通常是 gbk
+            files_to_send.append(f)
+            
+        for f in files_to_send:
+            self.service.send_file(f)
+
+    def _select_file_to_send(self):
+        files = filedialog.askopenfilenames()
+        if files:
+            for f in files:
+                self.service.send_file(f)
+
+    def _on_file_received(self, filepath):
+        self.root.after(0, lambda: self._on_file_received_ui(filepath))
+
+    def _on_file_received_ui(self, filepath):
+        self._log_file_ui(f"已接收: {os.path.basename(filepath)} (双击查看)", filepath)
+        # 接收完成即在后台进程中生成缩略图，打开图库时直接命中缓存
+        self._get_thumbnails().request(filepath)
+        if self.gallery is not None and self.gallery.winfo_exists():
+            self.gallery.add_file(filepath)
+
+    def _on_file_sent_success(self, filename):
+        self.root.after(0, lambda: self._log_file_ui(f"已发送: {filename}"))
+
+    def _on_transfer_update(self, transfer):
+        # 来自发送线程，合并为一次界面刷新，避免进度回调淹没 Tk 事件队列
+        if self._queue_refresh_pending or self.is_closing:
+            return
+        self._queue_refresh_pending = True
+        try:
+            self.root.after(100, self._refresh_queue)
+        except Exception:
+            self._queue_refresh_pending = False
+
+    def _refresh_queue(self):
+        self._queue_refresh_pending = False
+        status_text = {"queued": "排队", "running": "发送中", "paused": "已暂停",
+                       "done": "完成", "failed": "失败", "cancelled": "已取消"}
+        transfers = list(self.service.transfer_queue.transfers)
+        ids = set()
+        for t in transfers:
+            ids.add(t.id)
+            progress = f"{t.sent * 100 // t.size}%" if t.size else "-"
+            speed = f"{t.speed / 1024 / 1024:.1f} MB/s" if t.status == "running" and t.speed else ""
+            values = (t.name, progress, speed, status_text.get(t.status, t.status))
+            if self.tree_queue.exists(t.id):
+                self.tree_queue.item(t.id, values=values)
+            else:
+                self.tree_queue.insert("", tk.END, iid=t.id, values=values)
+        for iid in self.tree_queue.get_children():
+            if iid not in ids:
+                self.tree_queue.delete(iid)
+
+    def _selected_transfers(self):
+        return list(self.tree_queue.selection())
+
+    def _pause_selected(self):
+        for tid in self._selected_transfers(): self.service.transfer_queue.pause(tid)
+
+    def _resume_selected(self):
+        for tid in self._selected_transfers(): self.service.transfer_queue.resume(tid)
+
+    def _cancel_selected(self):
+        for tid in self._selected_transfers(): self.service.transfer_queue.cancel(tid)
+
+    def _prioritize_selected(self):
+        queue = self.service.transfer_queue
+        top = max((t.priority for t in queue.transfers), default=0)
+        for tid in self._selected_transfers(): queue.set_priority(tid, top + 1)
+
+    def _clear_finished(self):
+        self.service.transfer_queue.clear_finished()
+        self._refresh_queue()
+
+    def _log_file_ui(self, msg, filepath=None):
+        self.list_files.insert(0, msg)
+        self._file_list_paths.insert(0, filepath)
+
+    def _on_file_list_double_click(self, event):
+        # 双击接收记录: 打开图库并定位到该文件
+        selection = self.list_files.curselection()
+        filepath = self._file_list_paths[selection[0]] if selection else None
+        self._open_gallery(filepath)
+
+    def _get_thumbnails(self):
+        if self.thumbnails is None:
+            from thumbnail_cache import ThumbnailCache
+            self.thumbnails = ThumbnailCache(cache_dir="thumbnails")
+        return self.thumbnails
+
+    def _open_gallery(self, focus_path=None):
+        if self.gallery is not None and self.gallery.winfo_exists():
+            self.gallery.deiconify()
+            self.gallery.lift()
+            if focus_path:
+                self.gallery.focus_file(focus_path)
+            return
+        from gallery import GalleryWindow
+        self.gallery = GalleryWindow(self.root, self.file_manager.save_dir, self._get_thumbnails(), focus_path=focus_path)
+
+    def _open_recv_dir(self):
+        path = os.path.abspath(self.file_manager.save_dir)
+        os.startfile(path)
+
+    def _init_autorun_state(self):
+        try:
+            is_auto = self._check_autorun()
+            self.autorun_var.set(is_auto)
+        except Exception as e:
+            logging.error(f"注册表读取失败: {e}")
+
+    def _start_ip_check(self):
+        try: 
+            threading.Thread(target=self._update_ip_display, daemon=True).start()
+        except: pass
+
+    def _start_server_safe(self):
+        try: 
+            # 不等待监听就绪，避免阻塞 Tk 主循环；结果由服务线程写入日志
+            self.service.start(wait=False)
+        except Exception as e:
+            logging.error(f"Server启动失败: {e}")
+
+    def _init_tray_safe(self):
+        try:
+            self._init_tray()
+            logging.info("托盘图标已加载")
+        except Exception as e:
+            logging.error(f"托盘启动失败: {e}")
+
+    def _init_tray(self):
+        from PIL import Image, ImageDraw
+        import pystray
+        try:
+            # 尝试加载应用图标
+            icon_path = resource_path("pc_server/icon.ico")
+            if not os.path.exists(icon_path):
+                 icon_path = resource_path("icon.ico")
+            if not os.path.exists(icon_path) and os.path.exists("pc_server/icon.ico"):
+                 icon_path = "pc_server/icon.ico"
+            
+            image = Image.open(icon_path)
+        except Exception:
+            # 加载失败则绘制默认图标
+            width = 64
+            height = 64
+            image = Image.new('RGB', (width, height), color=(73, 109, 137))
+            dc = ImageDraw.Draw(image)
+            dc.rectangle([16, 16, 48, 48], fill='white')
+        
+        # 将左键点击绑定到显示窗口
+        menu = (pystray.MenuItem('显示窗口', self._show_window, default=True), pystray.MenuItem('退出', self._quit_app))
+        self.tray_icon = pystray.Icon("phone2pc", image, "Phone2PC 服务端", menu)
+        threading.Thread(target=self.tray_icon.run, daemon=True).start()
+
+    def _show_window(self, icon=None, item=None):
+        self.root.after(0, self.root.deiconify)
+
+    def _on_close_click(self):
+        self.root.withdraw()
+
+    def _quit_app(self, icon=None, item=None):
+        self.is_closing = True
+        if self.tray_icon: self.tray_icon.stop()
+        self.root.after(0, self._destroy_app)
+
+    def _destroy_app(self):
+        self.service.stop()
+        if self.thumbnails: self.thumbnails.close()
+        if self.log_sink: self.log_sink.close()
+        self.root.destroy()
+        sys.exit(0)
+
+    def _setup_logging(self):
+        # 日志先进环形缓冲区，再按固定帧率批量刷新到文本框，完整记录轮转写入 logs/
+        self.log_sink = LogSink(max_lines=2000, fps=10, file_path=os.path.join("logs", "phone2pc.log"))
+        formatter = logging.Formatter('%(asctime)s - %(message)s', datefmt='%H:%M:%S')
+        self.log_sink.setFormatter(formatter)
+        self.log_sink.attach(self.log_text)
+        logging.getLogger().addHandler(self.log_sink)
+        logging.getLogger().setLevel(logging.INFO)
+
+    def _check_autorun(self):
+        import winreg
+        try:
+            key = winreg.OpenKey(winreg.HKEY_CURRENT_USER, r"Software\Microsoft\Windows\CurrentVersion\Run", 0, winreg.KEY_READ)
+            winreg.QueryValueEx(key, "Phone2PC")
+            winreg.CloseKey(key)
+            return True
+        except: return False
+
+    def _toggle_autorun(self):
+        import winreg
+        if getattr(sys, 'frozen', False): target = sys.executable
+        else: target = f'"{sys.executable}" "{os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")}"'
+        try:
+            key = winreg.OpenKey(winreg.HKEY_CURRENT_USER, r"Software\Microsoft\Windows\CurrentVersion\Run", 0, winreg.KEY_SET_VALUE)
+            if self.autorun_var.get():
+                winreg.SetValueEx(key, "Phone2PC", 0, winreg.REG_SZ, target)
+                logging.info("已开启开机自启")
+            else:
+                try: winreg.DeleteValue(key, "Phone2PC"); logging.info("已关闭开机自启")
+                except: pass
+            winreg.CloseKey(key)
+        except Exception as e:
+            logging.error(f"设置开机自启失败: {e}")
+            self.autorun_var.set(not self.autorun_var.get())
+
+    def _update_list(self, type_):
+        if type_ == "pc":
+            data = self.clipboard_manager.pc_history
+            lb = self.list_pc
+        else:
+            data = self.clipboard_manager.phone_history
+            lb = self.list_phone
+        
+        lb.delete(0, tk.END)
+        for item in data:
+            display_text = item.replace('\n', ' ')[:30] + ('...' if len(item) > 30 else '')
+            lb.insert(tk.END, display_text)
+
+    def _on_pc_list_click(self, event):
+        idx = self.list_pc.curselection()
+        if idx:
+            text = self.clipboard_manager.pc_history[idx[0]]
+            self.clipboard_manager.set_clipboard(text)
+            logging.info("已复制 PC 历史记录")
+
+    def _on_phone_list_click(self, event):
+        idx = self.list_phone.curselection()
+        if idx:
+            text = self.clipboard_manager.phone_history[idx[0]]
+            self.clipboard_manager.set_clipboard(text) # 设置本机剪贴板
+            logging.info("已复制手机历史到本机")
+
+    def _clear_list(self, type_):
+        if type_ == "pc": self.clipboard_manager.pc_history.clear(); self._update_list("pc")
+        else: self.clipboard_manager.phone_history.clear(); self._update_list("phone")
+
+    def _update_ip_display(self):
+        ip = self._get_local_ip()
+        def update():
+            try:
+                self.ip_entry.configure(state='normal')
+                self.ip_entry.delete(0, tk.END)
+                self.ip_entry.insert(0, ip)
+                self.ip_entry.configure(state='readonly')
+            except: pass
+        self.root.after(0, update)
+
+    def _get_local_ip(self):
+        addresses = get_local_addresses()
+        if len(addresses) > 1:
+            logging.info(f"本机地址: {', '.join(addresses)}")
+        return addresses[0] if addresses else "127.0.0.1"
+
+def run_gui():
+    root = tk.Tk()
+    app = AppGUI(root)
+    if "--minimized" in sys.argv: root.withdraw()
+    root.mainloop()
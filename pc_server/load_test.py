@@ -0,0 +1,318 @@
+"""
+负载测试与会话回放：在本机回环上启动服务，用虚拟客户端重放录制的会话轨迹或混合负载，
+按消息类型统计延迟分位数、吞吐量与错误数。
+
+延迟 = 客户端开始发送 → 服务端处理完该帧 (含网络、接收队列、内存预算等待与分发)。
+服务端以单一设备为模型 (二进制帧只路由到当前接收的文件)，虚拟客户端之间的文件上传按顺序进行。
+
+用法:
+  python service.py --record-trace trace.gz                       # 在真实使用中录制轨迹
+  python load_test.py replay trace.gz [--speed 10] [--clients 50]  # 回放 (1x 或加速，多份并发)
+  python load_test.py mix [--clients 300] [--seconds 10]           # 剪贴板/文本输入/文件混合负载
+"""
+import asyncio
+import argparse
+import base64
+import collections
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import websockets
+
+from service import Phone2PCService
+from session_trace import load_trace, save_trace, synthesize
+
+
+class _NullInput:
+    """替代 InputHandler，压测时不向桌面输入文字"""
+    def type_text(self, text):
+        pass
+
+
+class Stats:
+    """按消息类型汇总延迟、字节数与错误 (服务端线程与客户端线程都会写入)"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = collections.defaultdict(list)
+        self.bytes = collections.Counter()
+        self.errors = collections.Counter()
+        self.skipped = collections.Counter()
+
+    def record(self, kind, size, latency, ok=True):
+        with self._lock:
+            self.latencies[kind].append(latency)
+            self.bytes[kind] += size
+            if not ok:
+                self.errors[kind] += 1
+
+    def error(self, kind, n=1):
+        with self._lock:
+            self.errors[kind] += n
+
+    def skip(self, kind):
+        with self._lock:
+            self.skipped[kind] += 1
+
+    def summary(self, elapsed):
+        rows = []
+        for kind in sorted(set(self.latencies) | set(self.errors)):
+            values = sorted(self.latencies.get(kind, []))
+            rows.append({
+                "type": kind,
+                "count": len(values),
+                "errors": self.errors.get(kind, 0),
+                "p50_ms": _percentile(values, 50) * 1000,
+                "p95_ms": _percentile(values, 95) * 1000,
+                "p99_ms": _percentile(values, 99) * 1000,
+                "max_ms": (values[-1] if values else 0) * 1000,
+                "msg_per_s": len(values) / elapsed if elapsed else 0,
+                "mb_per_s": self.bytes.get(kind, 0) / 1024 / 1024 / elapsed if elapsed else 0,
+            })
+        return rows
+
+
+def _percentile(values, p):
+    """最近秩分位数，values 已排序"""
+    if not values:
+        return 0.0
+    k = max(0, min(len(values) - 1, int(round(p / 100 * len(values) + 0.5)) - 1))
+    return values[k]
+
+
+class LatencyProbe:
+    """
+    服务端 tracer: 客户端发送前登记 (类型, 大小, 时间)，服务端处理完一帧后按连接取出对应登记，
+    同一连接上的帧按顺序处理，因此按 FIFO 对应即可。连接以客户端本地端口识别。
+    """
+    def __init__(self, stats):
+        self.stats = stats
+        self.pending = collections.defaultdict(collections.deque)
+
+    def expect(self, port, kind, size):
+        self.pending[port].append((kind, size, time.perf_counter()))
+
+    def opened(self, websocket):
+        pass
+
+    def frame(self, websocket, message, received_at, ok):
+        queue = self.pending.get(websocket.remote_address[1])
+        if not queue:
+            return
+        kind, size, sent_at = queue.popleft()
+        self.stats.record(kind, size, time.perf_counter() - sent_at, ok)
+
+    def closed(self, websocket):
+        pass
+
+    def outstanding(self):
+        return sum(len(q) for q in list(self.pending.values()))
+
+    def drop_outstanding(self):
+        """超时仍未处理的帧计为错误"""
+        for queue in list(self.pending.values()):
+            while queue:
+                kind, _, _ = queue.popleft()
+                self.stats.error(kind)
+
+
+def build_frame(kind, size, upload):
+    """按录制的类型与大小构造帧 (内容为填充数据)"""
+    if kind == "bin":
+        return bytes(size)
+    if kind == "text":
+        return "x" * max(1, size)
+    if kind == "CLIPBOARD_SYNC":
+        base = len(json.dumps({"type": kind, "content": ""}))
+        return json.dumps({"type": kind, "content": "x" * max(1, size - base)})
+    if kind == "FILE_OFFER":
+        return json.dumps({"type": kind, "file_id": upload["file_id"], "name": f"load_{upload['file_id']}.bin",
+                           "size": upload["size"]})
+    if kind == "FILE_DATA":
+        base = len(json.dumps({"type": kind, "file_id": upload["file_id"], "data": "", "last": False}))
+        raw = max(3, (size - base) // 4 * 3)
+        data = base64.b64encode(bytes(raw)).decode()
+        return json.dumps({"type": kind, "file_id": upload["file_id"], "data": data, "last": upload["last"]})
+    base = len(json.dumps({"type": kind, "pad": ""}))
+    return json.dumps({"type": kind, "pad": "x" * max(0, size - base)})
+
+
+class VirtualClient:
+    def __init__(self, uri, conn, start_at, speed, probe, stats, upload_lock):
+        self.uri = uri
+        self.conn = conn
+        self.start_at = start_at
+        self.speed = speed
+        self.probe = probe
+        self.stats = stats
+        self.upload_lock = upload_lock
+        self.upload = None  # 当前正在上传的文件 (持有 upload_lock)
+        self.received = 0
+
+    def _at(self, ms):
+        return self.start_at + ms / 1000 / self.speed
+
+    async def _sleep_until(self, deadline):
+        delay = deadline - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _drain(self, ws):
+        try:
+            async for message in ws:
+                self.received += 1
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    def _end_upload(self):
+        if self.upload:
+            self.upload = None
+            self.upload_lock.release()
+
+    async def run(self):
+        caps = self.conn["caps"]
+        if caps == "stripe":
+            self.stats.skip("stripe")  # 分片连接依附于 PC→手机 的发送，无法脱离服务端单独回放
+            return
+        await self._sleep_until(self._at(self.conn["start"]))
+        uri = self.uri + (f"/?caps={caps}" if caps and caps != "-" else "")
+        t0 = time.perf_counter()
+        try:
+            ws = await websockets.connect(uri, max_size=None, open_timeout=10)
+            await asyncio.wait_for(ws.recv(), 10)  # WELCOME
+        except Exception:
+            self.stats.error("open")
+            return
+        self.stats.record("open", 0, time.perf_counter() - t0)
+        port = ws.local_address[1]
+        reader = asyncio.create_task(self._drain(ws))
+        try:
+            for t, kind, size, arg in self.conn["events"]:
+                await self._sleep_until(self._at(t))
+                if kind == "close":
+                    break
+                if kind == "FILE_OFFER":
+                    self._end_upload()
+                    await self.upload_lock.acquire()
+                    file_id = uuid.uuid4().hex
+                    self.upload = {"file_id": file_id, "size": int(arg or 0), "remaining": int(arg or 0), "last": False}
+                elif kind in ("bin", "FILE_DATA") and not self.upload:
+                    self.stats.skip(kind)  # 轨迹从文件中途开始 (例如续传)，没有对应的 FILE_OFFER
+                    continue
+                if kind == "FILE_DATA":
+                    self.upload["last"] = arg == "1"
+                frame = build_frame(kind, size, self.upload)
+                self.probe.expect(port, kind, len(frame))
+                await ws.send(frame)
+                if kind == "bin":
+                    self.upload["remaining"] -= size
+                if self.upload and (self.upload["remaining"] <= 0 and kind == "bin" or self.upload["last"]):
+                    self._end_upload()
+        except websockets.exceptions.ConnectionClosed:
+            pass  # 已登记未处理的帧在结束时计为错误
+        finally:
+            self._end_upload()
+            await ws.close()
+            await reader
+
+
+async def run_load(conns, copies, speed, stagger, port, save_dir, drain_timeout=10.0):
+    """
+    启动服务并回放轨迹
+    :param copies: 同时回放的份数，第 i 份延后 i * stagger 秒开始
+    :return: (Stats, 耗时秒数)
+    """
+    stats = Stats()
+    probe = LatencyProbe(stats)
+    service = Phone2PCService(port=port, save_dir=save_dir, enable_clipboard=False,
+                              discovery_port=None, http_port=None, queue_state_path=None)
+    service.input_handler = _NullInput()
+    service.server.tracer = probe
+    service.server.max_clients = max(service.server.max_clients, len(conns) * copies + 8)
+    if not service.start():
+        raise RuntimeError("服务启动失败")
+
+    uri = f"ws://127.0.0.1:{port}"
+    upload_lock = asyncio.Lock()
+    t0 = time.perf_counter() + 0.1
+    clients = [VirtualClient(uri, conn, t0 + i * stagger, speed, probe, stats, upload_lock)
+               for i in range(copies) for conn in conns.values()]
+    try:
+        await asyncio.gather(*(c.run() for c in clients))
+        deadline = time.perf_counter() + drain_timeout
+        while probe.outstanding() and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+        elapsed = time.perf_counter() - t0
+        probe.drop_outstanding()
+    finally:
+        service.stop()
+    return stats, elapsed
+
+
+def print_report(stats, elapsed):
+    print(f"{'类型':<16}{'数量':>8}{'错误':>6}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'msg/s':>9}{'MB/s':>8}")
+    for r in stats.summary(elapsed):
+        print(f"{r['type']:<16}{r['count']:>8}{r['errors']:>6}{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}"
+              f"{r['p99_ms']:>9.1f}{r['max_ms']:>9.1f}{r['msg_per_s']:>9.1f}{r['mb_per_s']:>8.2f}")
+    if stats.skipped:
+        print("已跳过: " + ", ".join(f"{k} {v}" for k, v in sorted(stats.skipped.items())))
+    print(f"耗时 {elapsed:.1f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Phone2PC 负载测试与会话回放")
+    sub = parser.add_subparsers(dest="mode", required=True)
+    replay = sub.add_parser("replay", help="回放 service.py --record-trace 录制的轨迹")
+    replay.add_argument("trace")
+    replay.add_argument("--speed", type=float, default=1.0, help="回放倍速")
+    replay.add_argument("--clients", type=int, default=1, help="同时回放的份数")
+    replay.add_argument("--stagger", type=float, default=0.05, help="各份之间的启动间隔 (秒)")
+    mix = sub.add_parser("mix", help="虚拟客户端混合负载")
+    mix.add_argument("--clients", type=int, default=300)
+    mix.add_argument("--seconds", type=float, default=10)
+    mix.add_argument("--interval", type=float, default=0.5, help="每个客户端的平均消息间隔 (秒)")
+    mix.add_argument("--file-kb", type=int, default=256, help="每次文件传输的大小 (KB)")
+    mix.add_argument("--speed", type=float, default=1.0)
+    mix.add_argument("--seed", type=int)
+    mix.add_argument("--save", metavar="FILE", help="把生成的轨迹保存下来，便于用 replay 复现")
+    for p in (replay, mix):
+        p.add_argument("--port", type=int, default=8797)
+        p.add_argument("--json", metavar="FILE", help="把统计结果写成 JSON，便于版本间对比")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    if args.mode == "replay":
+        conns, copies, stagger = load_trace(args.trace), args.clients, args.stagger
+    else:
+        conns = synthesize(args.clients, args.seconds, interval=args.interval,
+                           file_size=args.file_kb * 1024, seed=args.seed)
+        copies, stagger = 1, 0
+        if args.save:
+            save_trace(args.save, conns)
+    if not conns:
+        print("轨迹为空")
+        return 1
+
+    workdir = tempfile.mkdtemp(prefix="phone2pc_load_")
+    try:
+        stats, elapsed = asyncio.run(run_load(conns, copies, args.speed, stagger, args.port,
+                                              os.path.join(workdir, "recv")))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(stats, elapsed)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"elapsed": elapsed, "types": stats.summary(elapsed), "skipped": dict(stats.skipped)}, f,
+                      ensure_ascii=False, indent=2)
+    return 1 if sum(stats.errors.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
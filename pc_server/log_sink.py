@@ -0,0 +1,159 @@
+import os
+import threading
+import logging
+from collections import deque
+
+
+class LogSink(logging.Handler):
+    """
+    批量、限速的日志输出:
+    - emit() 只把格式化后的文本放进环形缓冲区，可在任意线程调用，不触碰 Tk
+    - attach() 后由 Tk 主线程按固定帧率批量刷新到文本框，并限制保留行数
+    - 指定 file_path 时由后台线程批量写入磁盘，超过 max_bytes 自动轮转
+    """
+    def __init__(self, max_lines=2000, buffer_size=5000, fps=10,
+                 file_path=None, max_bytes=1024 * 1024, backup_count=3):
+        """
+        :param max_lines: 文本框最多保留的行数
+        :param buffer_size: 两次刷新之间最多缓存的记录数，超出则丢弃最旧的 (文件中仍有完整记录)
+        :param fps: 文本框每秒刷新次数
+        """
+        super().__init__()
+        self.max_lines = max_lines
+        self.interval_ms = max(1, int(1000 / fps))
+        self.file_path = file_path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+
+        self._lock = threading.Lock()
+        self._ui_buffer = deque(maxlen=buffer_size)
+        self._ui_dropped = 0
+        self._file_buffer = deque(maxlen=buffer_size * 4)
+        self._file_dropped = 0
+
+        self._widget = None
+        self._after_id = None
+        self._closed = False
+
+        self._file = None
+        self._file_event = threading.Event()
+        self._file_thread = None
+        if file_path:
+            folder = os.path.dirname(file_path)
+            if folder and not os.path.exists(folder):
+                os.makedirs(folder)
+            self._file = open(file_path, 'a', encoding='utf-8')
+            self._file_thread = threading.Thread(target=self._file_loop, daemon=True)
+            self._file_thread.start()
+
+    def emit(self, record):
+        try:
+            msg = self.format(record)
+        except Exception:
+            self.handleError(record)
+            return
+        with self._lock:
+            if self._widget is not None:
+                if len(self._ui_buffer) == self._ui_buffer.maxlen:
+                    self._ui_dropped += 1
+                self._ui_buffer.append(msg)
+            if self._file is not None:
+                if len(self._file_buffer) == self._file_buffer.maxlen:
+                    self._file_dropped += 1
+                self._file_buffer.append(msg)
+
+    # ---- Tk 文本框 ----
+
+    def attach(self, text_widget):
+        """绑定文本框并开始定时刷新 (需在 Tk 主线程调用)"""
+        self._widget = text_widget
+        self._after_id = text_widget.after(self.interval_ms, self._flush_widget)
+
+    def _flush_widget(self):
+        w = self._widget
+        if self._closed or w is None:
+            return
+        with self._lock:
+            lines = list(self._ui_buffer)
+            self._ui_buffer.clear()
+            dropped = self._ui_dropped
+            self._ui_dropped = 0
+
+        if lines:
+            if dropped:
+                lines.insert(0, f"... 日志过多，省略 {dropped} 条 ...")
+            try:
+                # 用户向上翻看时不强制滚动到底部
+                at_bottom = w.yview()[1] >= 0.999
+                w.configure(state='normal')
+                w.insert('end', '\n'.join(lines) + '\n')
+                total = int(w.index('end-1c').split('.')[0]) - 1
+                excess = total - self.max_lines
+                if excess > 0:
+                    w.delete('1.0', f'{excess + 1}.0')
+                if at_bottom:
+                    w.see('end')
+                w.configure(state='disabled')
+            except Exception:
+                pass  # 窗口已销毁
+
+        try:
+            self._after_id = w.after(self.interval_ms, self._flush_widget)
+        except Exception:
+            self._widget = None
+
+    # ---- 磁盘文件 ----
+
+    def _file_loop(self):
+        while not self._closed:
+            self._file_event.wait(0.5)
+            self._file_event.clear()
+            self._flush_file()
+
+    def _flush_file(self):
+        with self._lock:
+            lines = list(self._file_buffer)
+            self._file_buffer.clear()
+            dropped = self._file_dropped
+            self._file_dropped = 0
+        if not lines or self._file is None:
+            return
+        if dropped:
+            lines.insert(0, f"... 日志过多，省略 {dropped} 条 ...")
+        try:
+            self._file.write('\n'.join(lines) + '\n')
+            self._file.flush()
+            if self._file.tell() >= self.max_bytes:
+                self._rotate()
+        except Exception:
+            pass
+
+    def _rotate(self):
+        """phone2pc.log -> phone2pc.log.1 -> ... -> phone2pc.log.N"""
+        self._file.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            src = f"{self.file_path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.file_path}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(self.file_path, f"{self.file_path}.1")
+        else:
+            os.remove(self.file_path)
+        self._file = open(self.file_path, 'a', encoding='utf-8')
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._widget is not None and self._after_id:
+            try:
+                self._widget.after_cancel(self._after_id)
+            except Exception:
+                pass
+        if self._file_thread:
+            self._file_event.set()
+            self._file_thread.join(timeout=1)
+            self._flush_file()
+            self._file.close()
+            self._file = None
+        super().close()
@@ -0,0 +1,227 @@
+import collections
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import traceback
+
+_THREAD_NAME_RE = re.compile(r"^Thread-\d+ \((.+)\)$")
+
+
+def _thread_label(thread):
+    """线程名归一化: "Thread-12 (send_file)" -> "send_file"，线程池编号去掉，同类线程合并统计"""
+    m = _THREAD_NAME_RE.match(thread.name)
+    if m:
+        return m.group(1)
+    return re.sub(r"_\d+$", "", thread.name)
+
+
+def _frame_label(code):
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+
+
+class LoopDiagnostics:
+    """
+    事件循环诊断 (运行时开关，无需重启):
+    - 卡顿检测: 事件循环每 interval 秒执行一次心跳，看门狗线程发现心跳迟到超过 threshold 时
+      抓取事件循环线程当时的调用栈 (即正在阻塞循环的回调)，恢复后连同耗时写入日志。
+      若循环线程当时停在 select 上，说明不是回调阻塞，而是拿不到 GIL (其他线程占用)。
+    - 采样分析: 按固定频率采样所有线程的调用栈 (剪贴板监听、文件发送、输入等线程都包括在内)，
+      输出折叠栈格式 ("线程;函数;函数 次数")，可直接交给 flamegraph.pl / speedscope 生成火焰图。
+    """
+    def __init__(self, threshold=0.1, interval=0.05, profile_hz=100, output_dir="logs"):
+        """
+        :param threshold: 事件循环被阻塞超过该秒数视为卡顿
+        :param interval: 心跳间隔 (秒)
+        :param profile_hz: 采样频率
+        :param output_dir: 采样结果默认保存目录
+        """
+        self.threshold = threshold
+        self.interval = interval
+        self.profile_hz = profile_hz
+        self.output_dir = output_dir
+        self.stalls = collections.deque(maxlen=50)  # (time.time(), 阻塞秒数, 调用栈文本)
+        self.loop = None
+        self.loop_thread_id = None
+        self._beat = 0.0
+        self._watch_gen = 0
+        self._watch_stop = None
+        self._profile_stop = None
+        self._profile_thread = None
+        self._profile_counts = None
+        self._lock = threading.Lock()
+
+    def attach(self, loop):
+        """在事件循环线程中调用，绑定要监视的循环"""
+        self.loop = loop
+        self.loop_thread_id = threading.get_ident()
+        if self._watch_stop is not None:
+            self._start_heartbeat()
+
+    # ---- 卡顿检测 ----
+
+    @property
+    def watchdog_enabled(self):
+        return self._watch_stop is not None
+
+    def enable_watchdog(self, threshold=None):
+        with self._lock:
+            if threshold is not None:
+                self.threshold = threshold
+            if self._watch_stop is not None:
+                return
+            self._watch_gen += 1
+            self._watch_stop = threading.Event()
+            threading.Thread(target=self._watch, args=(self._watch_gen, self._watch_stop), daemon=True).start()
+        if self.loop:
+            self._start_heartbeat()
+        logging.info(f"事件循环卡顿检测已开启 (阈值 {self.threshold * 1000:.0f} ms)")
+
+    def disable_watchdog(self):
+        with self._lock:
+            if self._watch_stop is None:
+                return
+            self._watch_stop.set()
+            self._watch_stop = None
+            self._watch_gen += 1  # 旧的心跳链在下一次执行时自行结束
+        logging.info("事件循环卡顿检测已关闭")
+
+    def toggle_watchdog(self):
+        if self.watchdog_enabled:
+            self.disable_watchdog()
+        else:
+            self.enable_watchdog()
+
+    def _start_heartbeat(self):
+        gen = self._watch_gen
+        self._beat = time.perf_counter()
+        try:
+            self.loop.call_soon_threadsafe(self._heartbeat, gen)
+        except RuntimeError:
+            pass  # 事件循环已关闭
+
+    def _heartbeat(self, gen):
+        if gen != self._watch_gen:
+            return
+        self._beat = time.perf_counter()
+        self.loop.call_later(self.interval, self._heartbeat, gen)
+
+    def _watch(self, gen, stop):
+        stalled_at = None  # 卡顿开始时的心跳时间
+        stack = None
+        while not stop.wait(self.interval / 2):
+            if gen != self._watch_gen or not self.loop:
+                continue
+            beat = self._beat
+            blocked = time.perf_counter() - beat - self.interval
+            if stalled_at is None:
+                if blocked > self.threshold:
+                    stalled_at, stack = beat, self._capture_stacks()
+            elif beat != stalled_at:
+                # 心跳恢复: 两次心跳的间隔减去正常间隔即为阻塞时长
+                self._report(beat - stalled_at - self.interval, stack)
+                stalled_at = stack = None
+
+    def _capture_stacks(self):
+        frames = sys._current_frames()
+        names = {t.ident: _thread_label(t) for t in threading.enumerate()}
+        loop_frame = frames.get(self.loop_thread_id)
+        lines = []
+        if loop_frame is not None:
+            loop_stack = traceback.format_stack(loop_frame)
+            innermost = traceback.extract_stack(loop_frame)[-1]
+            if os.path.basename(innermost.filename) in ("selectors.py", "windows_events.py"):
+                lines.append("事件循环线程停在 select 上，没有回调在执行: 可能是其他线程长时间持有 GIL\n")
+            lines.extend(loop_stack)
+        lines.append("其他线程当时位置:\n")
+        me = threading.get_ident()
+        for ident, frame in frames.items():
+            if ident in (me, self.loop_thread_id):
+                continue
+            summary = traceback.extract_stack(frame)[-1]
+            lines.append(f"  [{names.get(ident, ident)}] {os.path.basename(summary.filename)}:{summary.lineno} "
+                         f"{summary.name}\n")
+        return "".join(lines)
+
+    def _report(self, duration, stack):
+        self.stalls.append((time.time(), duration, stack))
+        logging.warning(f"事件循环被阻塞 {duration * 1000:.0f} ms，阻塞时的调用栈:\n{stack}")
+
+    # ---- 采样分析 ----
+
+    @property
+    def profiler_running(self):
+        return self._profile_stop is not None
+
+    def start_profiler(self, hz=None):
+        with self._lock:
+            if self._profile_stop is not None:
+                return
+            self._profile_counts = collections.Counter()
+            self._profile_stop = threading.Event()
+            self._profile_thread = threading.Thread(
+                target=self._sample, args=(hz or self.profile_hz, self._profile_stop, self._profile_counts), daemon=True)
+            self._profile_thread.start()
+        logging.info(f"采样分析已开始 ({hz or self.profile_hz} Hz)")
+
+    def stop_profiler(self, path=None):
+        """
+        停止采样并写出折叠栈文件
+        :return: 文件路径，未在采样时返回 None
+        """
+        with self._lock:
+            if self._profile_stop is None:
+                return None
+            self._profile_stop.set()
+            thread, counts = self._profile_thread, self._profile_counts
+            self._profile_stop = self._profile_thread = self._profile_counts = None
+        thread.join()
+        if path is None:
+            os.makedirs(self.output_dir, exist_ok=True)
+            path = os.path.join(self.output_dir, time.strftime("profile-%Y%m%d-%H%M%S.folded"))
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in counts.most_common():
+                f.write(f"{stack} {count}\n")
+        logging.info(f"采样分析已保存: {path} ({sum(counts.values())} 个样本)")
+        return path
+
+    def toggle_profiler(self):
+        if self.profiler_running:
+            return self.stop_profiler()
+        self.start_profiler()
+        return None
+
+    def profile_for(self, seconds, on_done=None):
+        """后台采样 seconds 秒后自动保存，on_done(path) 在计时线程中回调"""
+        self.start_profiler()
+
+        def finish():
+            path = self.stop_profiler()
+            if on_done and path:
+                on_done(path)
+        timer = threading.Timer(seconds, finish)
+        timer.daemon = True
+        timer.start()
+
+    def _sample(self, hz, stop, counts):
+        me = threading.get_ident()
+        period = 1.0 / hz
+        names = {}
+        names_time = 0
+        while not stop.wait(period):
+            now = time.monotonic()
+            if now - names_time > 1:
+                # 线程列表每秒刷新一次即可，减少每次采样的开销
+                names = {t.ident: _thread_label(t) for t in threading.enumerate()}
+                names_time = now
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(ident, f"thread-{ident}"))
+                counts[";".join(reversed(stack))] += 1
@@ -0,0 +1,81 @@
+import asyncio
+import threading
+
+DEFAULT_LIMIT = 256 * 1024 * 1024
+
+
+class MemoryBudget:
+    """
+    进程级内存预算 (字节)。发送队列、接收缓冲、解码后的数据块都先预留再使用，用完释放。
+    - 工作线程: reserve() 在预算耗尽时阻塞 (发送背压)
+    - 事件循环: await reserve_async() 在预算耗尽时挂起，不再读取 socket (接收背压)
+    - force(): 不等待直接记账，用于事件循环线程里的小型控制消息
+    单次请求超过总额时按总额计，保证大消息最终也能通过 (独占全部预算)。
+    """
+    def __init__(self, limit=DEFAULT_LIMIT):
+        self.limit = limit
+        self.used = 0
+        self.peak = 0
+        self._cond = threading.Condition()
+        self._waiters = []  # (loop, future)
+
+    def _clamp(self, n):
+        return min(n, self.limit)
+
+    def _take(self, n):
+        self.used += n
+        if self.used > self.peak:
+            self.peak = self.used
+
+    def try_reserve(self, n):
+        n = self._clamp(n)
+        with self._cond:
+            if self.used + n > self.limit:
+                return False
+            self._take(n)
+            return True
+
+    def reserve(self, n, timeout=None):
+        """阻塞直到预留成功，超时返回 False"""
+        n = self._clamp(n)
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.used + n <= self.limit, timeout):
+                return False
+            self._take(n)
+            return True
+
+    async def reserve_async(self, n):
+        n = self._clamp(n)
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._cond:
+                if self.used + n <= self.limit:
+                    self._take(n)
+                    return
+                future = loop.create_future()
+                self._waiters.append((loop, future))
+            await future
+
+    def force(self, n):
+        with self._cond:
+            self._take(self._clamp(n))
+
+    def release(self, n):
+        with self._cond:
+            self.used = max(0, self.used - self._clamp(n))
+            self._cond.notify_all()
+            waiters, self._waiters = self._waiters, []
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, future)
+            except RuntimeError:
+                pass  # 事件循环已关闭
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+# 全进程共享的默认预算
+global_budget = MemoryBudget()
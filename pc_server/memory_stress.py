@@ -0,0 +1,179 @@
+"""
+内存上限压力测试：在本机回环上启动服务，模拟恶意/异常客户端，观察内存预算与进程 RSS 是否保持有界。
+
+场景:
+  1. 慢读者: PC 向一个从不读取的客户端发送大文件 (发送背压)
+  2. 洪泛: 多个客户端持续发送接近上限的二进制帧 (接收背压)
+  3. 超大帧: 单条消息超过大消息上限 (应被断开)
+  4. 旧版 Base64: 超大 FILE_DATA 文本帧 (流式解码)
+  5. 大段剪贴板: 超过普通上限的 CLIPBOARD_SYNC (占用大消息名额，应成功且不断开)
+
+客户端与服务端运行在同一进程，RSS 包含客户端自身的缓冲；预算峰值反映服务端占用。
+
+用法: python memory_stress.py [--budget-mb 128] [--clients 8] [--seconds 5]
+"""
+import asyncio
+import argparse
+import base64
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import websockets
+
+from memory_budget import MemoryBudget
+from service import Phone2PCService
+
+
+def current_rss_mb():
+    """当前进程常驻内存 (MB)，无法获取时返回 None"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 1024 / 1024
+    except ImportError:
+        return None
+
+
+class Monitor:
+    def __init__(self, budget):
+        self.budget = budget
+        self.peak_rss = 0
+        self._task = None
+
+    async def _run(self):
+        while True:
+            rss = current_rss_mb()
+            if rss:
+                self.peak_rss = max(self.peak_rss, rss)
+            await asyncio.sleep(0.05)
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def report(self, title):
+        rss = f"{self.peak_rss:.0f} MB" if self.peak_rss else "n/a"
+        print(f"[{title}] 预算峰值 {self.budget.peak / 1024 / 1024:.1f} / {self.budget.limit / 1024 / 1024:.0f} MB, "
+              f"当前 {self.budget.used / 1024 / 1024:.1f} MB, RSS 峰值 {rss}")
+
+
+async def slow_reader(uri, service, path, seconds):
+    async with websockets.connect(uri, max_size=None) as ws:
+        await ws.recv()  # WELCOME
+        service.send_file(path)
+        await asyncio.sleep(seconds)  # 从不读取
+
+
+async def flooder(uri, seconds, frame_size):
+    frame = os.urandom(frame_size)
+    deadline = time.monotonic() + seconds
+    sent = 0
+    try:
+        async with websockets.connect(uri, max_size=None) as ws:
+            await ws.recv()
+            # 不发 FILE_OFFER，服务端解析后丢弃，避免写满磁盘
+            while time.monotonic() < deadline:
+                await ws.send(frame)
+                sent += len(frame)
+    except websockets.exceptions.ConnectionClosed:
+        pass
+    return sent
+
+
+async def oversized(uri, size):
+    try:
+        async with websockets.connect(uri, max_size=None) as ws:
+            await ws.recv()
+            await ws.send(b"\0" * size)
+            await ws.recv()
+    except websockets.exceptions.ConnectionClosed as e:
+        return e.rcvd.code if e.rcvd else None
+    return None
+
+
+async def legacy_frame(uri, size):
+    async with websockets.connect(uri, max_size=None) as ws:
+        await ws.recv()
+        await ws.send(json.dumps({"type": "FILE_OFFER", "file_id": "legacy", "name": "legacy.bin", "size": size}))
+        data = base64.b64encode(os.urandom(size)).decode()
+        await ws.send(json.dumps({"type": "FILE_DATA", "file_id": "legacy", "data": data, "last": True}))
+        while True:
+            msg = json.loads(await ws.recv())
+            if msg.get("type") == "ACK" and msg.get("received") == size:
+                return True
+
+
+async def large_clipboard(uri, size):
+    async with websockets.connect(uri, max_size=None) as ws:
+        await ws.recv()
+        await ws.send(json.dumps({"type": "CLIPBOARD_SYNC", "id": "stress", "content": "x" * size}))
+        while True:
+            msg = json.loads(await ws.recv())
+            if msg.get("type") == "CLIPBOARD_ACK":
+                return msg.get("ok")
+
+
+async def run(args):
+    budget = MemoryBudget(args.budget_mb * 1024 * 1024)
+    workdir = tempfile.mkdtemp(prefix="phone2pc_stress_")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    service = Phone2PCService(port=args.port, save_dir=os.path.join(workdir, "recv"), enable_clipboard=False,
+                              discovery_port=None, http_port=None, budget=budget, queue_state_path=None)
+    try:
+        if not service.start():
+            return 1
+        uri = f"ws://127.0.0.1:{args.port}"
+        monitor = Monitor(budget)
+        monitor.start()
+
+        big = os.path.join(workdir, "big.bin")
+        with open(big, "wb") as f:
+            f.truncate(1024 * 1024 * 1024)  # 1GB 稀疏文件
+        await slow_reader(uri, service, big, args.seconds)
+        monitor.report("慢读者 1GB")
+
+        limit = service.server.receive_message_limit()
+        sent = await asyncio.gather(*[flooder(uri, args.seconds, limit) for _ in range(args.clients)])
+        monitor.report(f"洪泛 {args.clients} 客户端 ({limit // 1024} KB 帧), 共 {sum(sent) / 1024 / 1024:.0f} MB")
+
+        large = service.server.large_message_limit()
+        code = await oversized(uri, large * 2)
+        monitor.report(f"超大帧 {large * 2 // 1024} KB, 关闭码 {code}")
+
+        raw = (limit - 1024) // 4 * 3  # Base64 后接近单条消息上限
+        ok = await legacy_frame(uri, raw)
+        monitor.report(f"旧版 Base64 {limit // 1024} KB 帧, {'成功' if ok else '失败'}")
+
+        ok = await large_clipboard(uri, large - 1024)
+        monitor.report(f"大段剪贴板 {large // 1024} KB, {'成功' if ok else '失败'}")
+        return 0
+    finally:
+        service.stop()
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Phone2PC 内存上限压力测试")
+    parser.add_argument("--budget-mb", type=int, default=128)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--port", type=int, default=8798)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
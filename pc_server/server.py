@@ -1,29 +1,66 @@
 import asyncio
+import threading
+import time
 import websockets
 import logging
+from websockets.asyncio.server import ServerConnection
+from websockets.protocol import State
+
+from memory_budget import global_budget
+
+RECV_QUEUE = 1  # websockets 每个连接缓存的未处理帧数 (超过即暂停读取 socket)
 
 class WebSocketServer:
-    def __init__(self, host="0.0.0.0", port=8765, on_message_callback=None, on_connect_callback=None, on_disconnect_callback=None):
+    def __init__(self, host="0.0.0.0", port=8765, on_message_callback=None, on_connect_callback=None, on_disconnect_callback=None,
+                 budget=None, max_message_size=4 * 1024 * 1024, max_clients=16, tracer=None, ping_interval=20,
+                 ping_timeout=60, large_message_size=16 * 1024 * 1024, large_message_slots=2):
         """
         初始化 WebSocket 服务器
         :param on_message_callback: 收到消息时的回调函数 (func(text, websocket))
         :param on_connect_callback: 连接建立时的回调函数 (func(websocket))
         :param on_disconnect_callback: 连接断开时的回调函数 (func(websocket))
+        :param budget: 内存预算 (memory_budget.MemoryBudget)，默认使用进程共享预算
+        :param max_message_size: 单条消息上限，超过则断开连接 (1009)。
+                                 启动时按预算收紧，保证 max_clients 个连接的接收缓冲合计不超过预算的 1/4
+        :param large_message_size: 大消息连接的单条消息上限 (手机同步的大段剪贴板文本等)，同样按预算收紧
+        :param large_message_slots: 同时允许大消息的连接数。连接建立时先到先得，连接关闭后归还
+        :param max_clients: 同时连接数上限 (含分片连接)
+        :param ping_interval: 心跳间隔 (秒)，None 表示不发送心跳
+        :param ping_timeout: 心跳超时 (秒)，超时未收到 Pong 即断开。手机切换网络后留下的半开连接靠它清理，
+                             否则会一直占用 max_clients 名额
+        :param tracer: 帧观察者 (例如 session_trace.TraceRecorder)，需实现
+                       opened(ws) / frame(ws, message, received_at, ok) / closed(ws)，在事件循环线程中调用
         """
         self.host = host
         self.port = port
         self.on_message_callback = on_message_callback
         self.on_connect_callback = on_connect_callback
         self.on_disconnect_callback = on_disconnect_callback
+        self.budget = budget or global_budget
+        self.max_message_size = max_message_size
+        self.max_clients = max_clients
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.large_message_size = large_message_size
+        self.large_message_slots = large_message_slots
+        self.tracer = tracer
         self.clients = set()
+        # 监听端口绑定成功后置位，供其他线程等待服务器就绪
+        self.ready_event = threading.Event()
+        self._loop = None
+        self._stop_future = None
+        self._large_conns = set()  # 占用大消息名额的连接
+        self._large_limit = None
 
     async def register(self, websocket):
         self.clients.add(websocket)
         logging.info(f"新客户端连接: {websocket.remote_address}")
+        self._trace("opened", websocket)
 
     async def unregister(self, websocket):
         self.clients.remove(websocket)
         logging.info(f"客户端断开: {websocket.remote_address}")
+        self._trace("closed", websocket)
         if self.on_disconnect_callback:
             try:
                 import inspect
@@ -35,6 +72,11 @@ class WebSocketServer:
                 logging.error(f"Disconnect callback failed: {e}")
 
     async def handle_client(self, websocket):
+        # 心跳超时的连接正在等待对方确认关闭 (半开连接收不到)，不再占用名额
+        if sum(1 for c in self.clients if c.state is State.OPEN) >= self.max_clients:
+            logging.warning(f"连接数已达上限，拒绝: {websocket.remote_address}")
+            await websocket.close(1013, "too many connections")
+            return
         await self.register(websocket)
         # 新连接建立，触发回调 (例如发送当前剪贴板)
         if self.on_connect_callback:
@@ -49,48 +91,70 @@ class WebSocketServer:
 
         try:
             async for message in websocket:
-                if isinstance(message, bytes):
-                    # Binary Frame (File Data)
-                    if self.on_message_callback:
-                         # Compat with async/sync
-                        import inspect
-                        if inspect.iscoroutinefunction(self.on_message_callback):
-                            await self.on_message_callback(message, websocket)
-                        else:
-                            res = self.on_message_callback(message, websocket)
-                            if inspect.isawaitable(res):
-                                await res
-                    continue
-
-                # Text Frame (JSON)
-                # 简单判断：如果以 '{' 开头认为是 JSON，否则作为普通文本输入
-                if message.startswith('{') and '"type":' in message:
-                    # 尝试解析 type 以优化日志
-                    try:
-                         # 快速检查是否是 FILE_DATA (避免解析大 JSON)
-                         if '"type": "FILE_DATA"' in message or '"type":"FILE_DATA"' in message:
-                             logging.info("收到文件数据块...")
-                         else:
-                             logging.info(f"收到消息: {message[:50]}...")
-                    except:
-                        logging.info(f"收到消息: {message[:50]}...")
-                else:
-                    logging.info(f"收到消息: {message[:50]}...") # 避免日志过长
-                
-                if self.on_message_callback:
-                    # 兼容同步和异步回调
-                    import inspect
-                    if inspect.iscoroutinefunction(self.on_message_callback):
-                        await self.on_message_callback(message, websocket)
-                    else:
-                        res = self.on_message_callback(message, websocket)
-                        if inspect.isawaitable(res):
-                            await res
+                received_at = time.perf_counter()
+                size = len(message)
+                # 预算耗尽时在此挂起，不再从 socket 读取，websockets 接收队列满后 TCP 窗口随之关闭。
+                # 队列中的帧在此之前已读入内存，这部分由 receive_message_limit() / large_message_limit() 限定在预算的一半以内
+                await self.budget.reserve_async(size)
+                ok = False
+                try:
+                    await self._dispatch(message, websocket)
+                    ok = True
+                finally:
+                    self.budget.release(size)
+                    self._trace("frame", websocket, message, received_at, ok)
         except websockets.exceptions.ConnectionClosed:
             pass
         finally:
             await self.unregister(websocket)
 
+    def _trace(self, event, *args):
+        if self.tracer:
+            try:
+                getattr(self.tracer, event)(*args)
+            except Exception as e:
+                logging.error(f"Tracer failed: {e}")
+
+    async def _dispatch(self, message, websocket):
+        """把一条消息交给 on_message_callback (兼容同步/异步回调)"""
+        if isinstance(message, bytes):
+            # Binary Frame (File Data)
+            if self.on_message_callback:
+                 # Compat with async/sync
+                import inspect
+                if inspect.iscoroutinefunction(self.on_message_callback):
+                    await self.on_message_callback(message, websocket)
+                else:
+                    res = self.on_message_callback(message, websocket)
+                    if inspect.isawaitable(res):
+                        await res
+            return
+
+        # Text Frame (JSON)
+        # 简单判断：如果以 '{' 开头认为是 JSON，否则作为普通文本输入
+        if message.startswith('{') and '"type":' in message:
+            # 尝试解析 type 以优化日志
+            try:
+                 # 快速检查是否是 FILE_DATA (避免解析大 JSON)
+                 if '"type": "FILE_DATA"' in message or '"type":"FILE_DATA"' in message:
+                     logging.info("收到文件数据块...")
+                 else:
+                     logging.info(f"收到消息: {message[:50]}...")
+            except:
+                logging.info(f"收到消息: {message[:50]}...")
+        else:
+            logging.info(f"收到消息: {message[:50]}...") # 避免日志过长
+
+        if self.on_message_callback:
+            # 兼容同步和异步回调
+            import inspect
+            if inspect.iscoroutinefunction(self.on_message_callback):
+                await self.on_message_callback(message, websocket)
+            else:
+                res = self.on_message_callback(message, websocket)
+                if inspect.isawaitable(res):
+                    await res
+
     async def broadcast_activation(self):
         """向所有连接的客户端发送激活信号"""
         if not self.clients:
@@ -108,20 +172,76 @@ class WebSocketServer:
             except Exception as e:
                 logging.error(f"发送消息失败: {e}")
 
+    def receive_message_limit(self):
+        """
+        普通连接实际使用的单条消息上限。
+        websockets 在帧交给 handle_client (计入预算) 之前就已读入: 每个连接最多 RECV_QUEUE 帧在队列中、
+        1 帧正在读取。这部分缓冲限定在预算的一半以内，普通连接与大消息连接各占预算的 1/4:
+        最坏情况 max_clients × (RECV_QUEUE + 1) × 上限 不超过预算的 1/4 (但至少 64 KB，即一个文件数据块)。
+        """
+        per_frame = self.budget.limit // 4 // (self.max_clients * (RECV_QUEUE + 1))
+        return max(64 * 1024, min(self.max_message_size, per_frame))
+
+    def large_message_limit(self):
+        """大消息连接的单条消息上限: large_message_slots 个连接的接收缓冲合计不超过预算的 1/4"""
+        per_frame = self.budget.limit // 4 // (max(self.large_message_slots, 1) * (RECV_QUEUE + 1))
+        return max(self.receive_message_limit(), min(self.large_message_size, per_frame))
+
+    def _create_connection(self, protocol, *args, **kwargs):
+        """
+        websockets 连接工厂: 为新连接分配大消息名额。
+        握手请求解析完毕后 websockets 立即按当时的上限等待第一帧，之后再调整对已在读取的帧无效，
+        所以名额只能在这里 (读取任何数据之前) 分配，并一直保留到连接关闭。
+        没有名额的连接发送超过 receive_message_limit() 的消息仍会被断开 (1009)
+        """
+        connection = ServerConnection(protocol, *args, **kwargs)
+        self._large_conns = {c for c in self._large_conns if c.state is not State.CLOSED}
+        if len(self._large_conns) < self.large_message_slots:
+            self._large_conns.add(connection)
+            protocol.max_message_size = self._large_limit
+        return connection
+
     async def start(self):
         logging.info(f"启动 WebSocket 服务器于 ws://{self.host}:{self.port}")
-        # ping_interval=None: 禁用服务端主动 Ping，避免在传输大量数据阻塞时因未及时 Ping 而断连
-        # ping_timeout=None: 禁用超时检测
-        # max_size=None: 取消单条消息大小限制 (默认是 1MB，传 Base64 图片很容易超)
+        # ping_interval / ping_timeout: 心跳检测半开连接。超时放宽到 60 秒，
+        #   大量数据传输时 Pong 排在数据之后，也不会被误判断开
+        # max_size: 单条消息上限 (默认 1MB 对旧版 Base64 分块太小；不再设为无限制，防止单条消息耗尽内存)，
+        #   占有大消息名额的连接在 _create_connection 中放宽
+        # max_queue: 每个连接最多缓存的未处理帧数，配合内存预算形成接收背压
+        max_size = self.receive_message_limit()
+        if max_size < self.max_message_size:
+            logging.info(f"按内存预算将单条消息上限调整为 {max_size // 1024} KB")
+        self._large_limit = self.large_message_limit()
+        if self._large_limit < self.large_message_size:
+            logging.info(f"按内存预算将大消息上限调整为 {self._large_limit // 1024} KB")
+        self._loop = asyncio.get_running_loop()
+        self._stop_future = self._loop.create_future()
         async with websockets.serve(
             self.handle_client, 
             self.host, 
             self.port,
-            ping_interval=None, 
-            ping_timeout=None,
-            max_size=None 
+            ping_interval=self.ping_interval,
+            ping_timeout=self.ping_timeout,
+            max_size=max_size,
+            max_queue=RECV_QUEUE,
+            create_connection=self._create_connection
         ):
-            await asyncio.Future()  # run forever
+            self.ready_event.set()
+            await self._stop_future  # run until stop()
+        self.ready_event.clear()
+
+    def stop(self):
+        """停止服务器 (线程安全，可在任意线程调用)"""
+        if not self._loop or not self._stop_future:
+            return
+
+        def _resolve():
+            if not self._stop_future.done():
+                self._stop_future.set_result(None)
+        try:
+            self._loop.call_soon_threadsafe(_resolve)
+        except RuntimeError:
+            pass  # 事件循环已关闭
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
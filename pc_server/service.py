@@ -0,0 +1,538 @@
+import asyncio
+import threading
+import logging
+import json
+import time
+import sys
+import signal
+import argparse
+
+from server import WebSocketServer
+from clipboard_manager import ClipboardManager
+from file_manager import FileManager
+from session import SessionManager, parse_connect_params
+from discovery import DiscoveryResponder, DISCOVERY_PORT
+from download_server import DownloadServer, HTTP_PORT
+from transfer_queue import TransferQueue
+from file_manager import LEGACY_STREAM_THRESHOLD
+from memory_budget import MemoryBudget, global_budget
+from session_trace import TraceRecorder
+from loop_diagnostics import LoopDiagnostics
+import clipboard_sync
+
+PROTOCOL_VERSION = "v5.3"
+
+
+class Phone2PCService:
+    """
+    无界面核心服务: WebSocket 服务器 + 云剪贴板 + 文件传输 + 远程输入
+    GUI (gui.py) 与命令行 (python service.py) 共用此类。
+    """
+    def __init__(self, host="0.0.0.0", port=8765, save_dir="received_files", enable_clipboard=True,
+                 discovery_port=DISCOVERY_PORT, http_port=HTTP_PORT, on_pc_clipboard_change=None, on_phone_clipboard_change=None,
+                 on_file_received=None, on_file_sent=None, on_transfer_update=None, global_rate=0, budget=None,
+                 trace_path=None, diagnose=False, queue_state_path="transfer_queue.json"):
+        """
+        :param discovery_port: 局域网发现 UDP 端口，None 表示不启用
+        :param http_port: PC→手机 HTTP 下载端口，None 表示不启用
+        :param on_pc_clipboard_change: 本机剪贴板变化时的回调 func(text)
+        :param on_phone_clipboard_change: 收到手机剪贴板时的回调 func(text)
+        :param on_file_received: 文件接收完成的回调 func(path)
+        :param on_file_sent: 文件发送完成的回调 func(filename)
+        :param on_transfer_update: 发送队列任务状态/进度变化的回调 func(transfer)
+        :param global_rate: 发送总带宽上限 (字节/秒)，0 表示不限
+        :param budget: 内存预算 (memory_budget.MemoryBudget)，默认使用进程共享预算
+        :param trace_path: 记录客户端会话轨迹的文件 (供 load_test.py 回放)，None 表示不记录
+        :param diagnose: 启动时即开启事件循环卡顿检测 (运行中也可通过 self.diagnostics 开关)
+        :param queue_state_path: 发送队列持久化文件，None 表示不读取也不保存 (测试工具使用，避免发送真实的待发文件)
+        """
+        self.host = host
+        self.port = port
+        self.enable_clipboard = enable_clipboard
+        self.on_pc_clipboard_change = on_pc_clipboard_change
+        self.on_phone_clipboard_change = on_phone_clipboard_change
+        self.on_file_received = on_file_received
+        self.on_file_sent = on_file_sent
+
+        self.loop = None
+        self.server_thread = None
+        self.connected_websocket = None
+        self.budget = budget or global_budget
+        # 单连接在途发送上限: 一个不读数据的客户端最多占用这么多，不会拖住其他连接
+        self.max_inflight_per_connection = 8 * 1024 * 1024
+        self._inflight = {}  # websocket -> MemoryBudget
+        self.sessions = SessionManager(budget=self.budget)
+        self._stripes = {}  # 分片数据连接 websocket -> 分片状态，不参与会话与消息路由
+        self.tracer = TraceRecorder(trace_path) if trace_path else None
+        self.diagnostics = LoopDiagnostics()
+        if diagnose:
+            self.diagnostics.enable_watchdog()
+        # 剪贴板外发合并: ClipboardManager 每 1 秒轮询一次，1 秒内的多次复制只会看到最后一次，
+        # 因此合并窗口必须大于轮询间隔才有意义。距上次外发超过 clipboard_min_interval 的变化立即发送 (不增加延迟)；
+        # 窗口内的后续变化不逐条发送，窗口结束时只发最新内容
+        self.clipboard_min_interval = 2.0
+        self._clip_pending = None
+        self._clip_timer = None
+        self._clip_sent_at = float("-inf")
+        self._clip_last_sent = None
+        self._clip_send_lock = asyncio.Lock()  # 增量编码在线程池中进行，靠它保证发送顺序
+
+        # 轻量对象直接构造；耗时操作 (读剪贴板、导入 pyautogui) 放到 start() 中并发执行
+        self.server = WebSocketServer(
+            host=host,
+            port=port,
+            on_message_callback=self._handle_client_message,
+            on_connect_callback=self._on_new_client_connected,
+            on_disconnect_callback=self._on_client_disconnected,
+            budget=self.budget,
+            tracer=self.tracer
+        )
+        self.discovery = None
+        if discovery_port is not None:
+            self.discovery = DiscoveryResponder(service_port=port, version=PROTOCOL_VERSION, host=host, port=discovery_port)
+        self.download_server = DownloadServer(host=host, port=http_port) if http_port is not None else None
+        self.clipboard_manager = ClipboardManager(on_clipboard_change=self._on_pc_clipboard_change)
+        self.file_manager = FileManager(
+            save_dir=save_dir,
+            send_callback=self.send_raw,
+            on_receive_complete=self._on_file_received,
+            on_send_complete=self._on_file_sent,
+            download_server=self.download_server,
+            budget=self.budget
+        )
+        self.transfer_queue = TransferQueue(
+            self.file_manager,
+            state_path=queue_state_path,
+            global_rate=global_rate,
+            on_update=on_transfer_update
+        )
+
+        self.input_handler = None
+        self._input_lock = threading.Lock()
+
+    def start(self, wait=True, timeout=5.0):
+        """
+        并发启动各组件。服务器线程、剪贴板监听、输入模块预加载同时进行，
+        wait=True 时仅等待服务器开始监听即返回。
+        :return: 服务器是否已就绪 (wait=False 时总是 True)
+        """
+        t0 = time.perf_counter()
+        self.server_thread = threading.Thread(target=self._run_asyncio_loop, daemon=True)
+        self.server_thread.start()
+
+        if self.enable_clipboard:
+            threading.Thread(target=self._start_clipboard_safe, daemon=True).start()
+        # pyautogui 导入较慢 (数百毫秒)，后台预加载，不阻塞监听
+        threading.Thread(target=self._warmup_input_handler, daemon=True).start()
+        self.transfer_queue.start()
+
+        if not wait:
+            return True
+
+        deadline = t0 + timeout
+        while not self.server.ready_event.wait(0.005):
+            if not self.server_thread.is_alive() or time.perf_counter() > deadline:
+                logging.error("服务器启动失败")
+                return False
+        logging.info(f"服务已就绪: ws://{self.host}:{self.port} ({(time.perf_counter() - t0) * 1000:.0f} ms)")
+        return True
+
+    def stop(self):
+        self.transfer_queue.stop()
+        self.clipboard_manager.stop()
+        self.server.stop()
+        if self.tracer:
+            self.tracer.close()
+
+    def wait(self):
+        """阻塞直到服务器线程退出 (可被 Ctrl+C 打断)"""
+        while self.server_thread and self.server_thread.is_alive():
+            self.server_thread.join(0.5)
+
+    def _run_asyncio_loop(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.diagnostics.attach(self.loop)
+        try:
+            self.loop.run_until_complete(self._serve())
+        except Exception as e:
+            logging.error(f"Server启动失败: {e}")
+
+    async def _serve(self):
+        if self.discovery:
+            # 发现服务与 WebSocket 监听并行启动，不拖慢就绪时间
+            asyncio.get_running_loop().create_task(self._start_discovery())
+        if self.download_server:
+            asyncio.get_running_loop().create_task(self._start_download_server())
+        try:
+            await self.server.start()
+        finally:
+            if self.discovery:
+                self.discovery.stop()
+            if self.download_server:
+                self.download_server.stop()
+
+    async def _start_download_server(self):
+        try:
+            await self.download_server.start()
+        except OSError as e:
+            logging.error(f"HTTP 下载通道启动失败: {e}")
+            self.download_server = None
+            self.file_manager.download_server = None
+
+    async def _start_discovery(self):
+        try:
+            await self.discovery.start()
+        except OSError as e:
+            logging.error(f"局域网发现服务启动失败: {e}")
+
+    def _start_clipboard_safe(self):
+        try:
+            self.clipboard_manager.start()
+            logging.info("云剪贴板服务已启动")
+        except Exception as e:
+            logging.error(f"剪贴板服务启动失败: {e}")
+
+    def _warmup_input_handler(self):
+        try:
+            self._get_input_handler()
+        except Exception as e:
+            logging.error(f"输入模块加载失败: {e}")
+
+    def _get_input_handler(self):
+        with self._input_lock:
+            if self.input_handler is None:
+                from input_handler import InputHandler
+                self.input_handler = InputHandler()
+            return self.input_handler
+
+    def _type_text(self, text):
+        try:
+            self._get_input_handler().type_text(text)
+        except Exception as e:
+            logging.error(f"输入文本失败: {e}")
+
+    def send_raw(self, data):
+        """向当前客户端发送数据 (线程安全)，str 为 JSON 文本帧，bytes 为二进制帧"""
+        websocket = self.connected_websocket
+        if websocket and self.loop:
+            try:
+                self._send_budgeted(websocket, data)
+            except ConnectionError:
+                pass  # 发送途中断开，由续传逻辑处理
+
+    def _send_budgeted(self, websocket, data):
+        """
+        预留内存后投递发送，发送完成 (或失败) 时释放。
+        工作线程发送二进制数据时，预算耗尽会阻塞 (背压)；事件循环线程和控制消息不阻塞。
+        """
+        size = len(data)
+        conn_budget = self._inflight.get(websocket)
+        if conn_budget is None:
+            conn_budget = self._inflight.setdefault(websocket, MemoryBudget(self.max_inflight_per_connection))
+        budgets = (conn_budget, self.budget)
+        if isinstance(data, bytes) and threading.current_thread() is not self.server_thread:
+            for i, budget in enumerate(budgets):
+                while not budget.reserve(size, timeout=1.0):
+                    if websocket.close_code is not None:
+                        for reserved in budgets[:i]:
+                            reserved.release(size)
+                        raise ConnectionError("连接已断开")
+        else:
+            for budget in budgets:
+                budget.force(size)
+
+        def _release(_):
+            for budget in budgets:
+                budget.release(size)
+        future = asyncio.run_coroutine_threadsafe(websocket.send(data), self.loop)
+        future.add_done_callback(_release)
+        return future
+
+    async def _send_async(self, websocket, data):
+        """事件循环线程中发送并等待完成，与其他发送一样计入内存预算"""
+        await asyncio.wrap_future(self._send_budgeted(websocket, data))
+
+    def send_file(self, filepath, priority=0):
+        """加入发送队列，手机连接后按优先级发送"""
+        return self.transfer_queue.add(filepath, priority=priority)
+
+    def _on_pc_clipboard_change(self, text):
+        # PC 剪贴板变化 -> 立即通知 UI；发送给手机的同步经合并后再发
+        if self.on_pc_clipboard_change:
+            self.on_pc_clipboard_change(text)
+        self._clip_pending = text
+        loop = self.loop
+        if loop and loop.is_running():
+            loop.call_soon_threadsafe(self._schedule_clipboard_flush)
+        else:
+            self._flush_clipboard()
+
+    def _schedule_clipboard_flush(self):
+        """事件循环线程: 窗口外的变化立即发送，窗口内的变化合并到窗口结束时发送"""
+        if self._clip_timer is not None:
+            return  # 窗口结束时发送的是届时最新的 _clip_pending
+        wait = self._clip_sent_at + self.clipboard_min_interval - time.monotonic()
+        if wait <= 0:
+            self._flush_clipboard()
+        else:
+            self._clip_timer = self.loop.call_later(wait, self._flush_clipboard)
+
+    def _flush_clipboard(self):
+        self._clip_timer = None
+        text, self._clip_pending = self._clip_pending, None
+        if text is None or text == self._clip_last_sent:
+            return  # 合并期间又复制回了上次发送的内容
+        self._clip_last_sent = text
+        self._clip_sent_at = time.monotonic()
+        # 离线期间也记录序号，设备重连后据此回放
+        event = self.sessions.record_event({"type": "CLIPBOARD_SYNC", "source": "PC", "content": text})
+        websocket = self.connected_websocket
+        if websocket and self.loop:
+            asyncio.run_coroutine_threadsafe(self._send_event(websocket, event), self.loop)
+
+    async def _send_event(self, websocket, event):
+        session = self.sessions.find(websocket)
+        if session and event.get("type") == "CLIPBOARD_SYNC" and clipboard_sync.DELTA_CAP in session.caps:
+            async with self._clip_send_lock:
+                message = await self._encode_clipboard(session, event)
+                await self._send_async(websocket, json.dumps(message))
+        else:
+            await self._send_async(websocket, json.dumps(event))
+        if session and "seq" in event:
+            session.last_seq_sent = max(session.last_seq_sent, event["seq"])
+
+    async def _encode_clipboard(self, session, event):
+        """按对方最近确认的内容生成增量 (不划算时为全量)，并记下待确认的内容"""
+        text = event["content"]
+        message = {k: v for k, v in event.items() if k != "content"}
+        # 大文本逐行比对需要数百毫秒，放到线程池，不阻塞事件循环
+        fields = await asyncio.get_running_loop().run_in_executor(None, clipboard_sync.encode, text, session.clip_acked)
+        message.update(fields)
+        session.clip_sent[message["id"]] = text
+        session.clip_sent.move_to_end(message["id"])
+        while len(session.clip_sent) > 8:
+            session.clip_sent.popitem(last=False)
+        return message
+
+    def _on_clipboard_ack(self, websocket, data):
+        session = self.sessions.find(websocket)
+        if not session:
+            return
+        content_id = data.get("id")
+        text = session.clip_sent.get(content_id)
+        if data.get("ok", True):
+            if text is not None:
+                session.clip_acked = (content_id, text)
+            return
+        # 对方没有增量的基准: 清除基准，最近一次发送改为全量重发
+        session.clip_acked = None
+        if text is not None and next(reversed(session.clip_sent)) == content_id:
+            event = {"type": "CLIPBOARD_SYNC", "source": "PC", "content": text}
+            self.loop.create_task(self._send_event(websocket, event))
+
+    def _receive_phone_clipboard(self, websocket, data):
+        """还原手机发来的剪贴板 (全量或增量)，新版客户端 (消息带 id) 回复确认"""
+        session = self.sessions.find(websocket)
+        content = clipboard_sync.decode(data, session.phone_clip if session else None)
+        if content is None:
+            # 增量基准与本端不一致，请手机改发全量
+            self._send_budgeted(websocket, json.dumps({"type": "CLIPBOARD_ACK", "id": data.get("id"), "ok": False}))
+            return None
+        if data.get("id"):
+            if session:
+                session.phone_clip = (clipboard_sync.content_id(content), content)
+            self._send_budgeted(websocket, json.dumps({"type": "CLIPBOARD_ACK", "id": data["id"], "ok": True}))
+        return content
+
+    def _on_file_received(self, filepath):
+        if self.on_file_received:
+            self.on_file_received(filepath)
+
+    def _on_file_sent(self, filename):
+        if self.on_file_sent:
+            self.on_file_sent(filename)
+
+    def _handle_client_message(self, message, websocket):
+        stripe = self._stripes.get(websocket)
+        if stripe is not None:
+            self.file_manager.handle_stripe(stripe, message)
+            return
+
+        self.connected_websocket = websocket
+
+        # v5.0: Binary Frame -> FileManager directly
+        if isinstance(message, bytes):
+            self.file_manager.handle_binary(message)
+            return
+
+        # 超大的旧版 Base64 文件帧: 流式解码，避免整帧解析/解码的内存峰值
+        if len(message) >= LEGACY_STREAM_THRESHOLD and message.startswith('{'):
+            if self.file_manager.handle_legacy_frame(message):
+                return
+
+        try:
+            data = json.loads(message)
+            msg_type = data.get("type")
+
+            # 路由：剪贴板消息
+            if msg_type == "CLIPBOARD_SYNC":
+                content = self._receive_phone_clipboard(websocket, data)
+                if content:
+                    self.clipboard_manager.add_phone_history(content)
+                    if self.on_phone_clipboard_change:
+                        self.on_phone_clipboard_change(content)
+                    logging.info("收到手机剪贴板同步")
+                return
+
+            if msg_type == "CLIPBOARD_ACK":
+                self._on_clipboard_ack(websocket, data)
+                return
+
+            # 路由：会话恢复 (无法在握手 URL 中携带 token 的客户端)
+            if msg_type == "RESUME":
+                return self._open_session(websocket, data.get("session"), data.get("last_seq"), data.get("caps"))
+
+            # 路由：文件消息 (包括 ACK)
+            if msg_type in ["FILE_OFFER", "FILE_DATA", "FILE_END", "ACK", "FILE_RESUME"]:
+                self.file_manager.handle_message(data)
+                return
+        except (json.JSONDecodeError, AttributeError):
+            pass
+
+        # 默认作为文本输入处理
+        threading.Thread(target=self._type_text, args=(message,), daemon=True).start()
+
+    async def _on_new_client_connected(self, websocket):
+        token, last_seq, caps, stripe_id = parse_connect_params(websocket)
+        if stripe_id:
+            await self._attach_stripe(websocket, stripe_id)
+            return
+
+        self.connected_websocket = websocket
+        logging.info(f"新设备已连接: {websocket.remote_address}")
+
+        # 握手 URL 可携带 ?session=<token>&last_seq=<n>，直接恢复会话，无需额外往返
+        await self._open_session(websocket, token, last_seq, caps)
+
+    async def _attach_stripe(self, websocket, file_id):
+        def send(data):
+            return self._send_budgeted(websocket, data)
+
+        stripe = self.file_manager.attach_stripe(file_id, send)
+        if stripe is None:
+            logging.warning(f"未知文件或已开始发送的分片连接，已拒绝: {file_id}")
+            await websocket.close()
+            return
+        self._stripes[websocket] = stripe
+
+    async def _open_session(self, websocket, token, last_seq, caps=None):
+        session, resumed = self.sessions.open(websocket, token)
+        if caps:
+            session.caps = set(caps.split(",") if isinstance(caps, str) else caps)
+        self.file_manager.set_connected(True)
+        self.file_manager.http_download = "http_download" in session.caps
+        self.file_manager.stripe_send = "stripes" in session.caps
+
+        welcome = {"type": "WELCOME", "version": PROTOCOL_VERSION, "session": session.token,
+                   "resumed": resumed, "seq": self.sessions.seq}
+        if self.download_server:
+            welcome["http_port"] = self.download_server.port
+        events = []
+        if resumed:
+            try:
+                last_seq = int(last_seq)
+            except (TypeError, ValueError):
+                last_seq = session.last_seq_sent
+            events, gap = self.sessions.events_since(last_seq)
+            welcome["replay"] = len(events)
+            welcome["gap"] = gap  # True: 只回放了最新内容，客户端漏掉了中间的变化
+            welcome["transfers"] = self.file_manager.transfer_state()
+
+        # 握手确认 (v5.3: 携带会话 token)
+        try:
+            await self._send_async(websocket, json.dumps(welcome))
+        except Exception as e:
+            logging.error(f"发送 WELCOME 失败: {e}")
+            return
+
+        if resumed:
+            try:
+                self.file_manager.resume_receives()
+                for event in events:
+                    await self._send_event(websocket, event)
+                logging.info(f"会话已恢复，回放 {len(events)} 条剪贴板事件" + (" (中间变化已合并)" if gap else ""))
+            except Exception as e:
+                logging.error(f"会话恢复失败: {e}")
+            return
+
+        # 新会话：立即推送最新一条 PC 剪贴板历史
+        try:
+            if self.clipboard_manager.pc_history:
+                latest = self.clipboard_manager.pc_history[0]
+                if latest:
+                    await self._send_event(websocket, {"type": "CLIPBOARD_SYNC", "source": "PC", "content": latest})
+                    logging.info("已向新连接推送最新剪贴板内容")
+        except Exception as e:
+            logging.error(f"推送剪贴板失败: {e}")
+
+    async def _on_client_disconnected(self, websocket):
+        self._inflight.pop(websocket, None)
+        if self._stripes.pop(websocket, None) is not None:
+            return
+        logging.warning(f"设备已断开: {websocket.remote_address}")
+        self.sessions.close(websocket)
+        if self.connected_websocket == websocket:
+            self.connected_websocket = None
+            self.file_manager.set_connected(False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Phone2PC 无界面服务端")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--save-dir", default="received_files", help="接收文件保存目录")
+    parser.add_argument("--no-clipboard", action="store_true", help="不监听/同步本机剪贴板")
+    parser.add_argument("--discovery-port", type=int, default=DISCOVERY_PORT, help="局域网发现 UDP 端口")
+    parser.add_argument("--no-discovery", action="store_true", help="不响应局域网发现")
+    parser.add_argument("--http-port", type=int, default=HTTP_PORT, help="PC→手机 HTTP 下载端口")
+    parser.add_argument("--no-http", action="store_true", help="不启用 HTTP 下载通道")
+    parser.add_argument("--rate-limit", type=int, default=0, help="发送总带宽上限 (KB/s)，0 表示不限")
+    parser.add_argument("--send", nargs="+", metavar="FILE", help="加入发送队列的文件")
+    parser.add_argument("--record-trace", metavar="FILE", help="记录客户端会话轨迹 (帧类型/大小/时间)，供 load_test.py 回放")
+    parser.add_argument("--diagnose", action="store_true",
+                        help="开启事件循环卡顿检测；运行中 SIGUSR1 开关卡顿检测，SIGUSR2 开始/停止采样分析")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s', datefmt='%H:%M:%S')
+
+    service = Phone2PCService(
+        host=args.host,
+        port=args.port,
+        save_dir=args.save_dir,
+        enable_clipboard=not args.no_clipboard,
+        discovery_port=None if args.no_discovery else args.discovery_port,
+        http_port=None if args.no_http else args.http_port,
+        global_rate=args.rate_limit * 1024,
+        trace_path=args.record_trace,
+        diagnose=args.diagnose
+    )
+    if not service.start():
+        return 1
+    # 运行时开关诊断，无需重启 (Windows 没有 SIGUSR，使用 GUI 中的开关)
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, lambda *_: service.diagnostics.toggle_watchdog())
+        signal.signal(signal.SIGUSR2, lambda *_: service.diagnostics.toggle_profiler())
+    for path in args.send or []:
+        service.send_file(path)
+    try:
+        service.wait()
+    except KeyboardInterrupt:
+        logging.info("正在退出...")
+    finally:
+        service.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
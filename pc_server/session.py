@@ -0,0 +1,128 @@
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs
+
+
+class Session:
+    def __init__(self, token):
+        self.token = token
+        self.websocket = None
+        self.last_seq_sent = 0  # 最后一条成功写入 socket 的事件序号 (客户端未上报 last_seq 时使用)
+        self.last_seen = time.monotonic()
+        self.caps = set()  # 客户端声明支持的可选功能，例如 "http_download"
+        # 剪贴板增量同步 (clip_delta)，只在事件循环线程中读写
+        self.clip_acked = None  # (id, 内容) 对方最近确认的 PC 剪贴板，作为增量基准
+        self.clip_sent = OrderedDict()  # 已发出、等待确认的 id -> 内容
+        self.phone_clip = None  # (id, 内容) 本端最近确认的手机剪贴板，用于还原手机发来的增量
+
+
+class SessionManager:
+    """
+    会话令牌与事件回放:
+    - 每个设备首次连接分配一个 token，随 WELCOME 下发
+    - 服务端发出的剪贴板事件带递增 seq；剪贴板事件都是完整内容，后一条覆盖前一条，
+      因此只保留最新一条用于回放 (占用的内存计入预算)
+    - 设备带 token + last_seq 重连时，last_seq 之后有新事件则回放最新的一条
+    """
+    def __init__(self, session_ttl=600, max_sessions=16, budget=None):
+        """
+        :param session_ttl: 断开后会话保留的秒数
+        :param budget: 内存预算 (memory_budget.MemoryBudget)，保留的剪贴板内容计入其中
+        """
+        self.session_ttl = session_ttl
+        self.max_sessions = max_sessions
+        self.budget = budget
+        self.sessions = {}
+        self.latest_event = None
+        self._latest_size = 0
+        self.seq = 0
+        self._lock = threading.Lock()
+
+    def record_event(self, event):
+        """为事件分配序号并替换保留的最新事件，返回带 seq 的事件 (dict)"""
+        size = len(event.get("content") or "")
+        with self._lock:
+            self.seq += 1
+            event = dict(event, seq=self.seq)
+            if self.budget:
+                self.budget.force(size)
+                self.budget.release(self._latest_size)
+            self.latest_event, self._latest_size = event, size
+            return event
+
+    def open(self, websocket, token=None):
+        """
+        绑定连接到会话。token 有效时恢复原会话，否则新建。
+        :return: (session, resumed)
+        """
+        with self._lock:
+            self._expire()
+            session = self.sessions.get(token) if token else None
+            resumed = session is not None
+            if not resumed:
+                session = Session(secrets.token_urlsafe(16))
+                session.last_seq_sent = self.seq  # 新会话不回放历史
+                self.sessions[session.token] = session
+            # 通过 RESUME 消息恢复时，连接建立时临时分配的新会话作废
+            for other_token, other in list(self.sessions.items()):
+                if other.websocket is websocket and other is not session:
+                    del self.sessions[other_token]
+            session.websocket = websocket
+            session.last_seen = time.monotonic()
+            return session, resumed
+
+    def close(self, websocket):
+        with self._lock:
+            for session in self.sessions.values():
+                if session.websocket is websocket:
+                    session.websocket = None
+                    session.last_seen = time.monotonic()
+
+    def find(self, websocket):
+        with self._lock:
+            for session in self.sessions.values():
+                if session.websocket is websocket:
+                    return session
+            return None
+
+    def events_since(self, last_seq):
+        """
+        :return: (events, gap) events 至多一条 (最新内容)；
+                 gap=True 表示 last_seq 之后还有更早的变化被最新内容覆盖，未回放
+        """
+        with self._lock:
+            latest = self.latest_event
+            if latest is None or latest["seq"] <= last_seq:
+                return [], False
+            return [latest], latest["seq"] > last_seq + 1
+
+    def _expire(self):
+        now = time.monotonic()
+        for token, session in list(self.sessions.items()):
+            if session.websocket is None and now - session.last_seen > self.session_ttl:
+                del self.sessions[token]
+        # 数量上限：淘汰最久未活动的离线会话
+        idle = sorted((s for s in self.sessions.values() if s.websocket is None), key=lambda s: s.last_seen)
+        while len(self.sessions) > self.max_sessions and idle:
+            del self.sessions[idle.pop(0).token]
+
+
+def parse_connect_params(websocket):
+    """
+    从握手 URL 读取连接参数: ws://ip:8765/?session=xxx&last_seq=12&caps=http_download,stripes
+    分片数据连接: ws://ip:8765/?stripe=<file_id>
+    :return: (token, last_seq, caps, stripe)
+    """
+    request = getattr(websocket, "request", None)
+    path = request.path if request is not None else getattr(websocket, "path", "")
+    query = parse_qs(urlsplit(path or "").query)
+    token = query.get("session", [None])[0]
+    try:
+        last_seq = int(query["last_seq"][0])
+    except (KeyError, ValueError):
+        last_seq = None
+    caps = [c for c in query.get("caps", [""])[0].split(",") if c]
+    stripe = query.get("stripe", [None])[0]
+    return token, last_seq, caps, stripe
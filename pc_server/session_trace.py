@@ -0,0 +1,168 @@
+import gzip
+import json
+import logging
+import random
+import re
+import time
+
+from session import parse_connect_params
+
+TRACE_FORMAT = "phone2pc-trace"
+TRACE_VERSION = 1
+
+_TYPE_RE = re.compile(r'"type"\s*:\s*"(\w+)"')
+
+
+def classify(message):
+    """
+    帧类型: 二进制帧为 "bin"，JSON 信令为其 type 字段，其他文本为 "text" (远程输入)。
+    只看开头一小段，超大的旧版 FILE_DATA 帧也不会被整帧解析。
+    """
+    if isinstance(message, bytes):
+        return "bin"
+    if message.startswith('{'):
+        m = _TYPE_RE.search(message, 0, 256)
+        if m:
+            return m.group(1)
+    return "text"
+
+
+class TraceRecorder:
+    """
+    记录客户端会话轨迹 (WebSocketServer 的 tracer)，用于事后回放复现问题。
+    只记录帧类型、大小和时间，不记录内容 (剪贴板、输入文字、文件数据都不落盘)。
+
+    文件格式: gzip 文本，首行为 JSON 头，之后每行一个事件
+        <毫秒> <连接号> <事件> <字节数> [参数]
+    事件为 open / close 或帧类型 (见 classify)。参数: open 为客户端能力 (caps，分片连接为 "stripe")，
+    FILE_OFFER 为文件大小，FILE_DATA 为是否最后一块 (1/0)。
+    所有方法在事件循环线程中调用。
+    """
+    def __init__(self, path, flush_interval=5.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._file = gzip.open(path, "wt", encoding="utf-8")
+        self._file.write(json.dumps({"format": TRACE_FORMAT, "version": TRACE_VERSION, "started": time.time()}) + "\n")
+        self._t0 = time.perf_counter()
+        self._last_flush = self._t0
+        self._conn_ids = {}
+        self._next_id = 0
+        logging.info(f"正在记录会话轨迹: {path}")
+
+    def _write(self, websocket, event, size=0, arg=None):
+        if self._file is None:
+            return
+        conn = self._conn_ids.get(websocket)
+        if conn is None:
+            return
+        now = time.perf_counter()
+        line = f"{(now - self._t0) * 1000:.0f} {conn} {event} {size}"
+        if arg is not None:
+            line += f" {arg}"
+        self._file.write(line + "\n")
+        # 定期刷盘，进程被强制结束时也只丢最后几秒
+        if now - self._last_flush > self.flush_interval:
+            self._file.flush()
+            self._last_flush = now
+
+    def opened(self, websocket):
+        self._conn_ids[websocket] = self._next_id
+        self._next_id += 1
+        _, _, caps, stripe = parse_connect_params(websocket)
+        self._write(websocket, "open", arg="stripe" if stripe else (",".join(caps) or "-"))
+
+    def frame(self, websocket, message, received_at, ok):
+        kind = classify(message)
+        arg = None
+        if kind in ("FILE_OFFER", "FILE_DATA") and len(message) < 4096:
+            try:
+                data = json.loads(message)
+                arg = int(data.get("size") or 0) if kind == "FILE_OFFER" else int(bool(data.get("last")))
+            except (ValueError, TypeError, AttributeError):
+                pass
+        elif kind == "FILE_DATA":
+            arg = 1 if re.search(r'"last"\s*:\s*true', message[:256] + message[-64:]) else 0
+        self._write(websocket, kind, len(message), arg)
+
+    def closed(self, websocket):
+        self._write(websocket, "close")
+        self._conn_ids.pop(websocket, None)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def load_trace(path):
+    """
+    读取轨迹文件
+    :return: {连接号: {"caps": str, "events": [(毫秒, 事件, 字节数, 参数), ...]}}，按打开时间排序
+    """
+    conns = {}
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline() or "{}")
+        if header.get("format") != TRACE_FORMAT:
+            raise ValueError(f"不是 Phone2PC 轨迹文件: {path}")
+        try:
+            for line in f:
+                parts = line.split()
+                if len(parts) < 4:
+                    continue
+                t, conn, event, size = int(parts[0]), int(parts[1]), parts[2], int(parts[3])
+                arg = parts[4] if len(parts) > 4 else None
+                if event == "open":
+                    conns[conn] = {"caps": arg, "start": t, "events": []}
+                elif conn in conns:
+                    conns[conn]["events"].append((t, event, size, arg))
+        except EOFError:
+            pass  # 进程被强制结束，文件没有 gzip 结尾，保留已刷盘的部分
+    return dict(sorted(conns.items(), key=lambda item: item[1]["start"]))
+
+
+def save_trace(path, conns):
+    """把 load_trace / synthesize 格式的连接写回轨迹文件"""
+    lines = []
+    for conn, c in conns.items():
+        lines.append((c["start"], f"{c['start']} {conn} open 0 {c['caps'] or '-'}"))
+        for t, event, size, arg in c["events"]:
+            lines.append((t, f"{t} {conn} {event} {size}" + (f" {arg}" if arg is not None else "")))
+    lines.sort(key=lambda item: item[0])
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        f.write(json.dumps({"format": TRACE_FORMAT, "version": TRACE_VERSION, "started": time.time()}) + "\n")
+        for _, line in lines:
+            f.write(line + "\n")
+
+
+def synthesize(clients, seconds, interval=0.5, mix=(0.5, 0.4, 0.1), file_size=256 * 1024, chunk_size=64 * 1024, seed=None):
+    """
+    生成虚拟客户端轨迹: 每个客户端按泊松过程 (平均间隔 interval 秒) 随机发送剪贴板同步、文本输入或文件。
+    :param mix: (剪贴板, 文本输入, 文件) 的比例
+    :return: 与 load_trace 相同的结构
+    """
+    rng = random.Random(seed)
+    conns = {}
+    for conn in range(clients):
+        start = int(rng.uniform(0, min(1.0, seconds)) * 1000)  # 1 秒内陆续连上
+        events = []
+        t = start / 1000
+        while True:
+            t += rng.expovariate(1 / interval)
+            if t >= seconds:
+                break
+            ms = int(t * 1000)
+            pick = rng.random() * sum(mix)
+            if pick < mix[0]:
+                events.append((ms, "CLIPBOARD_SYNC", rng.randint(64, 4096), None))
+            elif pick < mix[0] + mix[1]:
+                events.append((ms, "text", rng.randint(1, 64), None))
+            else:
+                events.append((ms, "FILE_OFFER", 0, str(file_size)))
+                sent = 0
+                while sent < file_size:
+                    n = min(chunk_size, file_size - sent)
+                    events.append((ms, "bin", n, None))
+                    sent += n
+        events.append((int(seconds * 1000), "close", 0, None))
+        conns[conn] = {"caps": "-", "start": start, "events": events}
+    return conns
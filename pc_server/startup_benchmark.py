@@ -0,0 +1,77 @@
+"""
+启动耗时基准测试：以子进程方式运行无界面服务 (service.py)，
+测量从进程启动到 WebSocket 握手成功 (可接受连接) 的时间。
+
+用法: python startup_benchmark.py [--runs 10] [--port 8799]
+"""
+import asyncio
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import websockets
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+async def _wait_until_accepting(uri, timeout):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            async with websockets.connect(uri, open_timeout=1):
+                return True
+        except (OSError, asyncio.TimeoutError, websockets.exceptions.InvalidHandshake):
+            await asyncio.sleep(0.002)
+    return False
+
+
+def measure_once(port, timeout=10.0):
+    """返回从启动进程到握手成功的毫秒数，失败返回 None"""
+    cmd = [sys.executable, os.path.join(HERE, "service.py"), "--port", str(port), "--no-clipboard",
+           "--save-dir", os.path.join(HERE, "received_files")]
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=HERE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        ok = asyncio.run(_wait_until_accepting(f"ws://127.0.0.1:{port}", timeout))
+        elapsed = (time.perf_counter() - t0) * 1000
+        return elapsed if ok else None
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Phone2PC 启动耗时基准")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--port", type=int, default=8799)
+    args = parser.parse_args()
+
+    # 先测一次 Python 解释器自身的启动开销，便于对比
+    t0 = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], check=True)
+    baseline = (time.perf_counter() - t0) * 1000
+
+    results = []
+    for i in range(args.runs):
+        ms = measure_once(args.port)
+        if ms is None:
+            print(f"第 {i + 1} 次: 启动失败")
+            continue
+        results.append(ms)
+        print(f"第 {i + 1} 次: {ms:.1f} ms")
+
+    if not results:
+        return 1
+    print(f"\n解释器空启动: {baseline:.1f} ms")
+    print(f"可接受连接耗时: min {min(results):.1f} ms / median {statistics.median(results):.1f} ms / max {max(results):.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,211 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp", ".tif", ".tiff", ".ico"}
+
+
+def _build_thumbnail(path, cache_dir, size):
+    """
+    在进程池中执行: 计算内容哈希并生成 PNG 缩略图 (Tk 可直接加载 PNG，界面线程无需 Pillow 解码)
+    :return: (缓存键, 缩略图字节数)，无法解码时字节数为 0
+    """
+    mtime_ns = os.stat(path).st_mtime_ns
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    key = f"{h.hexdigest()}_{mtime_ns}"
+    dst = os.path.join(cache_dir, key + ".png")
+    if os.path.exists(dst):
+        return key, os.path.getsize(dst)  # 内容相同的文件共用缩略图
+
+    from PIL import Image, ImageOps
+    tmp = f"{dst}.{os.getpid()}.tmp"
+    try:
+        with Image.open(path) as img:
+            img.draft("RGB", size)  # JPEG 在解码时直接按比例缩小，大照片快很多
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail(size)
+            if img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGBA")
+            img.save(tmp, "PNG")
+        os.replace(tmp, dst)
+    except Exception:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        return key, 0
+    return key, os.path.getsize(dst)
+
+
+class ThumbnailCache:
+    """
+    接收文件缩略图的磁盘 LRU 缓存:
+    - 缩略图由 Pillow 在进程池中生成 (解码大照片不占用界面线程与 GIL)
+    - 缓存键为 内容哈希 + mtime，缩略图保存为 <键>.png
+    - 索引记录 路径 → (大小, mtime, 键)，再次打开时只需 stat 即可命中，不重新读取或解码原图
+    - 缩略图总大小超过 max_bytes 时按最近使用顺序淘汰
+    """
+    def __init__(self, cache_dir="thumbnails", size=(128, 128), max_bytes=256 * 1024 * 1024, max_entries=50000,
+                 workers=2):
+        """
+        :param size: 缩略图最大宽高
+        :param workers: 生成缩略图的进程数
+        """
+        self.cache_dir = cache_dir
+        self.size = size
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.workers = workers
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.entries = OrderedDict()  # 键 -> 缩略图字节数 (0 表示无法解码)，末尾为最近使用
+        self.paths = {}  # 绝对路径 -> (文件大小, mtime_ns, 键)
+        self.total = 0
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pending = {}  # 绝对路径 -> [callback]
+        self._last_save = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def is_image(path):
+        return os.path.splitext(path)[1].lower() in IMAGE_EXTS
+
+    def lookup(self, path, st=None):
+        """
+        查询缓存 (不读取原文件内容)
+        :param st: 调用方已有的 os.stat 结果，可省一次 stat
+        :return: 缩略图路径；"" 表示已知无法生成；None 表示未缓存或文件已变化
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            known = self.paths.get(path)
+            if not known:
+                return None
+            try:
+                st = st or os.stat(path)
+            except OSError:
+                return None
+            size, mtime_ns, key = known
+            if st.st_size != size or st.st_mtime_ns != mtime_ns or key not in self.entries:
+                del self.paths[path]
+                return None
+            self.entries.move_to_end(key)
+            if not self.entries[key]:
+                return ""
+            return os.path.join(self.cache_dir, key + ".png")
+
+    def request(self, path, callback=None):
+        """
+        后台生成缩略图 (同一文件的并发请求只生成一次)
+        :param callback: 完成后回调 func(path, thumb_path)，thumb_path 含义同 lookup，在进程池的回调线程中调用
+        """
+        path = os.path.abspath(path)
+        if not self.is_image(path):
+            return
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        with self._lock:
+            if path in self._pending:
+                if callback:
+                    self._pending[path].append(callback)
+                return
+            self._pending[path] = [callback] if callback else []
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            try:
+                future = self._pool.submit(_build_thumbnail, path, self.cache_dir, self.size)
+            except RuntimeError:
+                del self._pending[path]  # 进程池已关闭
+                return
+        future.add_done_callback(lambda f: self._on_built(path, st, f))
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+            self._save()
+        if pool:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    # ---- 内部 ----
+
+    def _on_built(self, path, st, future):
+        thumb = None
+        try:
+            key, nbytes = future.result()
+        except Exception as e:
+            if not future.cancelled():
+                logging.error(f"生成缩略图失败: {os.path.basename(path)}: {e}")
+            key = None
+        with self._lock:
+            callbacks = self._pending.pop(path, [])
+            if key:
+                self.paths[path] = (st.st_size, st.st_mtime_ns, key)
+                if key not in self.entries:
+                    self.entries[key] = nbytes
+                    self.total += nbytes
+                self.entries.move_to_end(key)
+                self._evict()
+                thumb = os.path.join(self.cache_dir, key + ".png") if nbytes else ""
+                # 批量生成时不必每张都写索引
+                if time.monotonic() - self._last_save > 2 or not self._pending:
+                    self._save()
+        for callback in callbacks:
+            try:
+                callback(path, thumb)
+            except Exception as e:
+                logging.error(f"缩略图回调失败: {e}")
+
+    def _evict(self):
+        """调用方持有 _lock"""
+        while self.entries and (self.total > self.max_bytes or len(self.entries) > self.max_entries):
+            key, nbytes = self.entries.popitem(last=False)
+            self.total -= nbytes
+            if nbytes:
+                try:
+                    os.remove(os.path.join(self.cache_dir, key + ".png"))
+                except OSError:
+                    pass
+
+    def _save(self):
+        """调用方持有 _lock"""
+        self._last_save = time.monotonic()
+        live = set(self.entries)
+        data = {
+            "version": 1,
+            "entries": list(self.entries.items()),
+            "paths": {p: list(v) for p, v in self.paths.items() if v[2] in live},
+        }
+        tmp = self.index_path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp, self.index_path)
+        except OSError as e:
+            logging.error(f"保存缩略图索引失败: {e}")
+
+    def _load(self):
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, encoding="utf-8") as f:
+                data = json.load(f)
+            # 不逐个检查缩略图文件是否存在 (数万条时拖慢启动)；被手动删除的由界面加载失败后重新生成
+            for key, nbytes in data.get("entries", []):
+                self.entries[key] = nbytes
+                self.total += nbytes
+            for path, (size, mtime_ns, key) in data.get("paths", {}).items():
+                if key in self.entries:
+                    self.paths[path] = (size, mtime_ns, key)
+        except (OSError, ValueError, TypeError) as e:
+            logging.error(f"读取缩略图索引失败: {e}")
@@ -0,0 +1,348 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+
+class TransferCancelled(Exception):
+    pass
+
+
+class TransferPaused(Exception):
+    """单连接发送途中被暂停: 中止本次发送、让出发送通道，继续时重新排队从头发送"""
+    pass
+
+
+class TokenBucket:
+    """令牌桶限速 (字节/秒)，rate <= 0 表示不限速。可被多个线程共享"""
+    def __init__(self, rate=0):
+        self._lock = threading.Lock()
+        self.rate = 0
+        self.capacity = 0
+        self.tokens = 0
+        self.stamp = time.monotonic()
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        with self._lock:
+            self.rate = rate or 0
+            self.capacity = max(self.rate, 64 * 1024)  # 最多攒 1 秒的突发量
+            self.tokens = min(self.tokens, self.capacity)
+            self.stamp = time.monotonic()
+
+    def reserve(self, n):
+        """预扣 n 个令牌 (允许透支)，返回调用方需要等待的秒数"""
+        with self._lock:
+            if self.rate <= 0:
+                return 0
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.tokens -= n
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+
+class Transfer:
+    """
+    队列中的一个发送任务，同时作为 FileManager.send_file 的传输控制对象
+    status: queued / running / paused / done / failed / cancelled
+    """
+    def __init__(self, queue, path, priority=0, rate_limit=0, transfer_id=None, status="queued"):
+        self.queue = queue
+        self.id = transfer_id or str(uuid.uuid4())
+        self.path = path
+        self.name = os.path.basename(path)
+        self.size = os.path.getsize(path) if os.path.exists(path) else 0
+        self.priority = priority
+        self.rate_limit = rate_limit
+        self.status = status
+        self.sent = 0
+        self.speed = 0.0
+        self.created = time.time()
+        self.bucket = TokenBucket(rate_limit)
+        self._run_event = threading.Event()
+        if status != "paused":
+            self._run_event.set()
+        self._cancelled = False
+        self._active = False  # 是否已被工作线程取走
+        self._started = False  # 是否已取得发送通道 (之前即使被取走也仍显示为排队)
+        self._speed_stamp = time.monotonic()
+        self._speed_bytes = 0
+        self._lock = threading.Lock()
+
+    # ---- FileManager 回调 (发送线程中调用) ----
+
+    def on_start(self):
+        """取得发送通道、开始发送"""
+        self.queue._mark_started(self)
+
+    def before_chunk(self, n, yield_on_pause=False):
+        """
+        :param yield_on_pause: 暂停时不原地等待，抛出 TransferPaused (调用方持有单连接发送锁时使用，
+                               否则暂停的任务会挡住其他所有单连接发送)
+        """
+        if yield_on_pause and not self._run_event.is_set() and not self._cancelled:
+            raise TransferPaused("传输已暂停")
+        while not self._run_event.wait(0.2):
+            if self._cancelled:
+                break
+        if self._cancelled:
+            raise TransferCancelled("传输已取消")
+        delay = max(self.bucket.reserve(n), self.queue.global_bucket.reserve(n))
+        # 分段睡眠，限速期间也能及时响应取消
+        deadline = time.monotonic() + delay
+        while not self._cancelled:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(remaining, 0.1))
+        if self._cancelled:
+            raise TransferCancelled("传输已取消")
+
+    def poll_chunk(self, n):
+        """
+        before_chunk 的非阻塞版本，供事件循环中的 HTTP 下载通道使用
+        :return: 发送前需要等待的秒数；暂停中返回 None (调用方稍后再问)
+        """
+        if self._cancelled:
+            raise TransferCancelled("传输已取消")
+        if not self._run_event.is_set():
+            return None
+        return max(self.bucket.reserve(n), self.queue.global_bucket.reserve(n))
+
+    def on_progress(self, n):
+        with self._lock:
+            self.sent = max(0, min(self.size, self.sent + n))
+            self._speed_bytes += n
+            now = time.monotonic()
+            elapsed = now - self._speed_stamp
+            if elapsed < 0.25:
+                return
+            self.speed = max(0.0, self._speed_bytes / elapsed)
+            self._speed_stamp = now
+            self._speed_bytes = 0
+        self.queue._notify(self)
+
+    def to_dict(self):
+        return {"id": self.id, "path": self.path, "priority": self.priority,
+                "rate_limit": self.rate_limit, "status": self.status, "created": self.created}
+
+
+class TransferQueue:
+    """
+    持久化的发送队列:
+    - 最多 max_workers 个文件同时发送，按优先级 (数值大者优先)、加入时间排序
+    - 全局与单任务带宽上限 (令牌桶)
+    - 暂停 / 继续 / 取消 / 调整优先级。暂停运行中的单连接任务会让出发送通道 (其他任务继续发送)，
+      继续后重新排队从头发送；分片与排队中的任务原地暂停
+    - 未完成的任务保存在 state_path，重启后继续 (从头重新发送)
+    说明: 单连接发送由 FileManager 串行化；HTTP 下载通道由客户端拉取，服务端按块限速，暂停时挂起下载连接。
+    """
+    def __init__(self, file_manager, state_path="transfer_queue.json", max_workers=3, global_rate=0, on_update=None):
+        """
+        :param global_rate: 全局带宽上限 (字节/秒)，0 表示不限
+        :param on_update: 任务状态或进度变化时的回调 func(transfer)，在工作线程中调用
+        """
+        self.file_manager = file_manager
+        self.state_path = state_path
+        self.max_workers = max_workers
+        self.global_bucket = TokenBucket(global_rate)
+        self.on_update = on_update
+        self.transfers = []
+        self._cond = threading.Condition()
+        self._running = False
+        self._load()
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        for _ in range(self.max_workers):
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+    # ---- 公开操作 (任意线程) ----
+
+    def add(self, path, priority=0, rate_limit=0):
+        transfer = Transfer(self, path, priority=priority, rate_limit=rate_limit)
+        with self._cond:
+            self.transfers.append(transfer)
+            self._save()
+            self._cond.notify()
+        logging.info(f"已加入发送队列: {transfer.name}")
+        self._notify(transfer)
+        return transfer
+
+    def get(self, transfer_id):
+        with self._cond:
+            for t in self.transfers:
+                if t.id == transfer_id:
+                    return t
+        return None
+
+    def pause(self, transfer_id):
+        self._set_state(transfer_id, "paused", ("queued", "running"))
+
+    def resume(self, transfer_id):
+        self._set_state(transfer_id, None, ("paused",))
+
+    def cancel(self, transfer_id):
+        self._set_state(transfer_id, "cancelled", ("queued", "running", "paused"))
+
+    def set_priority(self, transfer_id, priority):
+        with self._cond:
+            t = self.get(transfer_id)
+            if t:
+                t.priority = priority
+                self._save()
+
+    def set_global_limit(self, rate):
+        self.global_bucket.set_rate(rate)
+
+    def set_limit(self, transfer_id, rate):
+        t = self.get(transfer_id)
+        if t:
+            t.rate_limit = rate
+            t.bucket.set_rate(rate)
+            with self._cond:
+                self._save()
+
+    def clear_finished(self):
+        with self._cond:
+            self.transfers = [t for t in self.transfers if t.status not in ("done", "failed", "cancelled")]
+            self._save()
+
+    # ---- 内部 ----
+
+    def _set_state(self, transfer_id, state, allowed):
+        with self._cond:
+            t = self.get(transfer_id)
+            if not t or t.status not in allowed:
+                return
+            if state == "paused":
+                # 运行中的任务在下一块数据前暂停: 单连接发送中止并让出发送通道，分片发送原地阻塞
+                t._run_event.clear()
+                t.status = "paused"
+            elif state == "cancelled":
+                t._cancelled = True
+                t._run_event.set()
+                t.status = "cancelled"
+            else:
+                # 继续: 已在发送的任务直接放行，否则 (含工作线程中仍在等待发送通道的) 回到排队
+                t.status = "running" if t._started else "queued"
+                t._run_event.set()
+                self._cond.notify()
+            self._save()
+        self._notify(t)
+
+    def _next(self):
+        candidates = [t for t in self.transfers if t.status == "queued" and not t._active]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda t: (t.priority, -t.created))
+
+    def _worker(self):
+        while True:
+            # 手机未连接时不取任务，连接后再按优先级挑选
+            while self._running and not self.file_manager.wait_connected(0.5):
+                pass
+            with self._cond:
+                transfer = None
+                while self._running:
+                    transfer = self._next()
+                    if transfer:
+                        break
+                    self._cond.wait()
+                if not self._running:
+                    return
+                # 取得发送通道前仍显示为排队 (见 _mark_started)
+                transfer._active = True
+
+            ok = False
+            yielded = False
+            if not transfer._cancelled and self._running:
+                try:
+                    ok = self.file_manager.send_file(transfer.path, transfer=transfer)
+                except TransferCancelled:
+                    logging.info(f"已取消发送: {transfer.name}")
+                except TransferPaused:
+                    logging.info(f"已暂停发送: {transfer.name}，让出发送通道")
+                    yielded = True
+            with self._cond:
+                transfer._active = False
+                transfer._started = False
+                transfer.speed = 0.0
+                if transfer._cancelled:
+                    transfer.status = "cancelled"
+                elif yielded:
+                    # 让出期间已被继续 (状态为 running) 时直接重新排队
+                    if transfer.status != "paused":
+                        transfer.status = "queued"
+                        self._cond.notify()
+                elif not self._running:
+                    transfer.status = "queued"  # 退出时保留，下次启动继续
+                elif ok:
+                    transfer.status = "done"
+                    transfer.sent = transfer.size
+                else:
+                    transfer.status = "failed"
+                self._save()
+            self._notify(transfer)
+
+    def _mark_started(self, transfer):
+        with self._cond:
+            transfer._started = True
+            transfer.sent = 0
+            if transfer.status == "queued":
+                transfer.status = "running"
+            self._save()
+        self._notify(transfer)
+
+    def _notify(self, transfer):
+        if self.on_update:
+            try:
+                self.on_update(transfer)
+            except Exception as e:
+                logging.error(f"传输队列回调失败: {e}")
+
+    def _save(self):
+        """只持久化未完成的任务 (调用方持有 _cond)"""
+        if not self.state_path:
+            return
+        pending = [t.to_dict() for t in self.transfers if t.status in ("queued", "running", "paused")]
+        tmp = self.state_path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"transfers": pending}, f, ensure_ascii=False)
+            os.replace(tmp, self.state_path)
+        except OSError as e:
+            logging.error(f"保存传输队列失败: {e}")
+
+    def _load(self):
+        if not self.state_path or not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                items = json.load(f).get("transfers", [])
+        except (OSError, ValueError) as e:
+            logging.error(f"读取传输队列失败: {e}")
+            return
+        for item in items:
+            path = item.get("path")
+            if not path or not os.path.exists(path):
+                logging.warning(f"队列中的文件已不存在，跳过: {path}")
+                continue
+            # 上次退出时正在发送的任务重新排队
+            status = "paused" if item.get("status") == "paused" else "queued"
+            t = Transfer(self, path, priority=item.get("priority", 0), rate_limit=item.get("rate_limit", 0),
+                         transfer_id=item.get("id"), status=status)
+            t.created = item.get("created", t.created)
+            self.transfers.append(t)
+        if self.transfers:
+            logging.info(f"已恢复 {len(self.transfers)} 个未完成的发送任务")